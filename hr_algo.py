@@ -1,111 +1,184 @@
-from machine import Pin, I2C,
-from rollingaverage import RollingAverage as RollAvg
-from peripherals import IRS_ADC
-from filo import Filo
+from peripherals import IRS_ADC, RotaryEncoder
+from detector import PeakDetector
 from piotimer import Piotimer
 from fifo import Fifo
-import ssd1306
+from display import Display
+from memmanager import MemoryManager
+from sensorworker import SensorWorker
+from quality import SignalQuality
+from capture import CaptureWriter, new_capture_file
+from hrvwindow import HRVWindow
 import time
-import _thread
+import asyncio
         
 class HRA:
     # GPIO PINS
     SENSOR_PIN = 26								# Heart rate sensor pin
-    SDA_PIN = 14								# OLED SDA pin
-    SCL_PIN = 15								# OLED SCL pin
+    ROT_A_PIN = 10								# Rotary encoder A pin
+    ROT_B_PIN = 11								# Rotary encoder B pin
+    ROT_BUTTON_PIN = 12							# Rotary encoder button pin
     
-    # ALGORITHM PARAMETERS
-    COOLDOWN = 500								# Total cooldown(ms)
-    TRESHOLD = 0.7								# Peak detection treshold
+    # ALGORITHM PARAMETERS are in PeakDetector
     SAMPLE_FREQUENCY = 250						# HR sensor sample frequency
+    WARM_TIMEOUT = 60000						# Detector stays warm after recording(ms)
+    PRESAMPLE = True							# Pre-sample in background when asked
+    CAPTURE = False								# Save raw samples of recordings
+    MONITOR_WINDOW = 60000						# Monitoring HRV window(ms)
+    DISPLAY_TIMEOUT = 10000						# Monitoring display on time(ms)
+    MAX_RECORDING = 60000						# HRV recording time limit(ms)
     #SAMPLE_PERIOD = int(1 / SAMPLE_FREQUENCY * 1000) # REDUNDANT
     
     
-    def __init__(self, display=None):
+    def __init__(self, display=None, encoder=None, memory=None, adc=None):
         """
         PARAMS:
-        display(SSD1306 object): if for passing OLED object.
+        display(Display object): if for passing the shared display object.
+        encoder(RotaryEncoder object): for passing rotary encoder object.
+        memory(MemoryManager object): for passing the shared memory manager.
+        adc(object): for replacing the sensor ADC, for example with
+        ppgsynth.PPGSynth.
         """
         # INITALIZE DISPLAY.
         if not display:
-            # Initialize I2C pin and channel
-            i2c = I2C(1, sda=Pin(HRA.SDA_PIN), scl=Pin(HRA.SCL_PIN), freq=400000)
-            i2c.scan()
-            # Initialize OLED with I2C pin
-            display = ssd1306.SSD1306_I2C(128, 64, i2c)
+            display = Display()
         self.OLED = display        
         # INITIALIZE HR SENSOR.
-        self.sensor = IRS_ADC(HRA.SENSOR_PIN)
-        # GPIO PINS
-        self.rot_button = Pin(12, mode = Pin.IN, pull = Pin.PULL_UP)
+        self.sensor = IRS_ADC(HRA.SENSOR_PIN, adc=adc)
+        # INITIALIZE ROTARY ENCODER.
+        if not encoder:
+            encoder = RotaryEncoder(HRA.ROT_A_PIN, HRA.ROT_B_PIN, HRA.ROT_BUTTON_PIN)
+        self.encoder = encoder
+        # INITIALIZE DETECTOR. Integer signal path.
+        self.detector = PeakDetector(sample_frequency=HRA.SAMPLE_FREQUENCY)
+        self.detector.debug = True
+        # INITIALIZE MEMORY MANAGER. Keeps GC pauses out of sampling.
+        if not memory:
+            memory = MemoryManager()
+        self.memory = memory
+        # START CORE 1 WORKER. Runs for the whole uptime and is the only
+        # reader of the sensor fifo.
+        self.worker = SensorWorker(self.sensor, self.detector)
+        self.worker.start()
+        self.sensor_timer = None
+        self.last_stop = None							# End of last recording(ticks ms)
+        self.capture = None								# CaptureWriter of current recording
+        self.capture_file = None						# Capture file of last recording
+        self.mode = 0
     
     
-    def start_recording(self, mode=None): # ------------------------------------
+    def busy(self): # ----------------------------------------------------------
+        # True while a timed recording runs. Blocking calls on core 0 would
+        # then freeze the display and delay capture writes. Monitoring runs
+        # for hours without capture, so it doesn't count.
+        return (self.mode != 3
+                and self.worker.state in (SensorWorker.FILLING, SensorWorker.RUNNING))
+    
+    
+    def start_timer(self): # ---------------------------------------------------
+        # Start sampling timer if it's not running.
+        if self.sensor_timer is None:
+            self.sensor_timer = Piotimer(mode = Piotimer.PERIODIC,
+                                         freq = HRA.SAMPLE_FREQUENCY,
+                                         callback = self.sensor.handler)
+    
+    
+    def stop_timer(self): # ----------------------------------------------------
+        if self.sensor_timer is not None:
+            self.sensor_timer.deinit()
+            self.sensor_timer = None
+    
+    
+    async def start_presampling(self): # ---------------------------------------
+        # Sample in the background, for example while the menu is open, so
+        # that the next recording starts warm.
+        if not HRA.PRESAMPLE or self.worker.state != SensorWorker.IDLE:
+            return
+        self.start_timer()
+        await self.worker.command(SensorWorker.PRESAMPLE)
+    
+    
+    async def stop_presampling(self): # ----------------------------------------
+        if self.worker.state == SensorWorker.PRESAMPLING:
+            self.stop_timer()
+            await self.worker.command(SensorWorker.STOP)
+    
+    
+    async def start_recording(self, mode=None, capture=None, on_summary=None): #
+        """
+        PARAMS:
+        mode(int): 0 shows heart rate only, 1 and 2 return PPI data and 3 is
+        continuous monitoring.
+        capture(bool): Save raw samples to flash. Default is HRA.CAPTURE.
+        on_summary(function): Called with HRV summary dict of every window
+        in mode 3.
+        """
         self.OLED.fill(0)
         self.OLED.text("Initializing...", 0, 0, 1)
         self.OLED.show()
         
-        # Algorithm vars
-        self.max_value = None							# Max value of current peak
-        self.sample_n = 0								# Total amount of samples
-        self.peaks = []									# All recorded peaks
-        self.last_samples_avg_10 = RollAvg(size=10)		# Rolling average of last 10 samples
-        self.last_samples_avg_40 = RollAvg(size=40)		# Rolling average of last 40 samples
-        self.last_samples_raw = Filo(250, typecode = "i")# Last 250 raw sample values
-        self.last_peak = None 							# Last peak timestamp(tick)
-        self.bpm = 0									# Current BPM
-        self.lts_min = None								# Last second lowest value
-        self.lts_max = None								# Last second highest value
-        self.ppi_roll_avg = RollAvg(size=10)			# Rolling average of last 10 PPI(ms)
-        self.cur_cooldown = 0							# Time since artifact(ms)
-        self.last_artifact_timestamp = 0				# Last artifact timestamp(tick)
-        self.artifact_count = 0							# Total amount of artifacts
-        self.thread_running = True						# Global flag for stopping 2. thread
+        # Detector starts warm if it has been pre-sampling or the last
+        # recording ended recently.
+        self.warm = (self.worker.state == SensorWorker.PRESAMPLING
+                     or (self.last_stop is not None
+                         and time.ticks_diff(time.ticks_ms(), self.last_stop) < HRA.WARM_TIMEOUT))
+        
+        # Free caches and collect now so that automatic collections don't
+        # land in the middle of sampling.
+        self.memory.start_session()
         
         # Set mode to 0 by default
-        if not mode or (mode != 1 and mode != 2):
+        if not mode or mode not in (1, 2, 3):
             mode = 0
         self.mode = mode
         print("Recording starting...")
         print(f"Mode {mode} selected.")
         
-        self.sensor_timer = Piotimer(mode = Piotimer.PERIODIC,
-                                     freq = HRA.SAMPLE_FREQUENCY,
-                                     callback = self.sensor.handler)
+        # Monitoring keeps only the PPIs of the current window. Capture
+        # would fill the flash.
+        if mode == 3:
+            capture = False
+            self.window = HRVWindow(HRA.MONITOR_WINDOW)
+            self.on_summary = on_summary
+        else:
+            self.window = None
+        self.detector.keep_peaks = mode != 3
+        self.detector.window = self.window
+        
+        # Raw sample capture. File name is the local time like history ids.
+        if capture is None:
+            capture = HRA.CAPTURE
+        self.capture_file = None
+        if capture:
+            self.capture_file = new_capture_file(int(time.time() + 3 * 3600))
+            self.capture = CaptureWriter(self.capture_file, HRA.SAMPLE_FREQUENCY)
+            await self.worker.command(SensorWorker.CAPTURE, self.capture)
+        
+        self.start_timer()
         
-        self.fill_buffer()
-        return self.record_hrv()
+        await self.fill_buffer()
+        if mode == 3:
+            return await self.monitor()
+        return await self.record_hrv()
 
     
-    def fill_buffer(self): # ---------------------------------------------------
-        # Find pulse and min-max values.
-        print("Initializing...")
-        while True :
-            if self.sensor.has_data():
-                smpl = self.sensor.get()
-                # Check if pulse found
-                if smpl > 1000:
-                    self.sample_n += 1
-                    # Restart if pulse is lost
-                    if self.sample_n > 500:
-                        break
-                else:
-                    self.sample_n = 0
-                self.last_samples_raw.put(smpl)	# Store value for min-max
+    async def fill_buffer(self): # ---------------------------------------------
+        # Worker resets the detector, finds pulse and min-max values and then
+        # starts detecting.
+        print("Initializing..." + (" (warm)" if self.warm else ""))
+        await self.worker.command(SensorWorker.START, self.warm)
+        while self.worker.state != SensorWorker.RUNNING:
+            # Let other tasks run while waiting for pulse.
+            await asyncio.sleep_ms(10)
         print("Buffer ready")
         
     
-    def record_hrv(self): # ----------------------------------------------------
+    async def record_hrv(self): # ----------------------------------------------
         
         # Main program =========================================================
         print("Main program start")
         
-        # Reset total samples recorded
-        self.sample_n = 0
         # Start timer
         self.start_time = time.ticks_ms()
-        # Start thread 1
-        _thread.start_new_thread(self.core_1_func, ())
 
         # Buffer for graph line dots.
         line_buffer = [32] * 64
@@ -118,32 +191,43 @@ class HRA:
         
         # Is enough data collected for anaylsis.
         self.measurement_ready = False
-        btn_pressed = False
+        timed_out = False
+        self.encoder.clear()
         
         while True:
             # Rotary button stops recording.
-            if self.rot_button() == 0:
-                btn_pressed = True
-            if btn_pressed and self.rot_button() == 1:
-                self.stop()
+            if self.encoder.get_event() in ("short", "long"):
+                await self.stop()
                 break
-            if self.last_samples_avg_10.count > 0:
+            if self.detector.last_samples_avg_10.count > 0:
                 
-                # If measurement is not ready, update progress.
+                # Progress is the share of clean beats needed for analysis.
+                # Recording ends as soon as there are enough. At the time
+                # limit the beats so far are used if there are enough for a
+                # less accurate result.
+                quality = self.detector.quality
                 if self.mode == 1 or self.mode == 2:
-                    if not self.measurement_ready:
-                        progress = time.ticks_diff(time.ticks_ms(), self.start_time) / 30000
-                        if progress >= 1:
-                            self.measurement_ready = True
-                            progress = 1
+                    progress = quality.progress()
+                    if quality.ready():
+                        self.measurement_ready = True
+                        await self.stop()
+                        break
+                    if time.ticks_diff(time.ticks_ms(), self.start_time) >= HRA.MAX_RECORDING:
+                        self.measurement_ready = quality.usable()
+                        timed_out = True
+                        await self.stop()
+                        break
                 
                 self.OLED.fill(0)
                 
-                # Display READY text if enough data is collected.
-                if self.measurement_ready:
-                    self.OLED.text("READY", 87, 0)
-                self.OLED.text(f"BPM:{self.bpm}", 0, 0)				# Current BPM
-                y = int(60 - (52 * self.last_samples_avg_10.get()))	# Sample Y coord
+                # Signal quality index. Low quality is shown inverted.
+                if quality.index < SignalQuality.POOR:
+                    self.OLED.fill_rect(86, 0, 42, 8, 1)
+                    self.OLED.text(f"Q:{quality.index}", 87, 0, 0)
+                else:
+                    self.OLED.text(f"Q:{quality.index}", 87, 0)
+                self.OLED.text(f"BPM:{self.detector.bpm}", 0, 0)	# Current BPM
+                y = int(60 - (52 * self.detector.level()))			# Sample Y coord
                 
                 add_to_line(y)
                 
@@ -160,139 +244,115 @@ class HRA:
                 if self.mode == 1 or self.mode == 2:
                     self.OLED.fill_rect(0, 60, int(127 * progress), 3, 1)
                 self.OLED.show()
+                # Frame is out. Write captured samples and collect garbage
+                # now if needed.
+                if self.capture:
+                    self.capture.flush()
+                self.memory.idle_collect()
+            # Let background tasks run between frames.
+            await asyncio.sleep_ms(0)
         
         # If not enough data is collected for analysis. Dispaly error and don't
         # return PPI data.
         if (self.mode != 0) and (not self.measurement_ready):
             self.OLED.fill(0)
-            self.OLED.text("Not enough data", 5, 24, 1)
+            if timed_out:
+                self.OLED.text("Signal too poor", 4, 24, 1)
+            else:
+                self.OLED.text("Not enough data", 5, 24, 1)
             self.OLED.show()
-            time.sleep(2)
+            await asyncio.sleep(2)
             return None
-        return self.peaks
+        return self.detector.peaks
 
 
-    # Function for core 1. .----------------------------------------------------
-    def core_1_func(self):
-        # Core 1 collects the sensor data and processes it. All functionality
-        # apart from drawing on the OLED screen is found here.
-        
-        print("[Core 1] Running...")
-        
-        # Check thread running flag. Used for stopping thread 1.
-        while self.thread_running:
-            if self.sensor.has_data():
-                sample = self.sensor.get()	# Get sample from sensor fifo.
-                
-                # Check for movement artifacts
-                self.cur_cooldown = time.ticks_diff(time.ticks_ms(), self.last_artifact_timestamp)
-                if (sample < 10000 or sample > 60000) and self.cur_cooldown > HRA.COOLDOWN:
-                    print("Pulse artifact")
-                    self.artifact_count += 1
-                    self.last_artifact_timestamp = time.ticks_ms()
-                    continue
-                
-                self.last_samples_raw.put(sample)	# Store raw sample to fifo.
-                
-                sample = self.normalize(sample)		# Normalize raw sample to 0-1.
-                self.update_rolling_averages(sample)	# Update rolling averages.
-                
-                self.sample_n += 1					# Keep track of total recorded samples
-                
-                # Calculate peak-to-peak interval.
-                interval = 0	# Time since last peak, in milliseconds
-                if self.last_peak != None :
-                    # Calculate the time since last peak in milliseconds
-                    interval = time.ticks_diff(time.ticks_ms(), self.last_peak)
-                else:
-                    # If there is no peaks so far, interval is time since start
-                    # Not the best approach. Maybe FIX.
-                    interval = time.ticks_diff(time.ticks_ms(), self.start_time)
-                
-                # Check for peak.
-                if self.is_peak(sample):
-                    print("PEAK")
-                    self.last_peak = time.ticks_ms()
-                    
-                    # Filter heart beat echo and impossible heart rates.
-                    if interval < 300:
-                        continue
-                    elif interval > 1700:
-                        continue
-                    self.peaks.append(interval)
-                    # Calculate current PPI
-                    self.ppi_avg = self.ppi_roll_avg.update(interval)
-                    # Calculate current BPM
-                    self.bpm = int(60 / (self.ppi_avg / 1000))
-
-    # Find min and max values of recent values
-    def find_min_max(self): # --------------------------------------------------
-        # Max and min functions are slow. But this function is called only once
-        # per second.
-        self.lts_max = max(self.last_samples_raw.data)
-        self.lts_min = min(self.last_samples_raw.data)
-
-
-    # Normalize any sample value to 0-1
-    def normalize(self, sample_value): # ---------------------------------------
-        # Find min and max values every second.
-        if self.sample_n % 250 == 0:
-            self.find_min_max()
-        # Apply min max normalization to raw sample value.
-        normalized_sample = (sample_value - self.lts_min) / (self.lts_max - self.lts_min)
+    async def monitor(self): # -------------------------------------------------
+        # Continuous monitoring. HRV of the last window is passed to
+        # on_summary once per window. Display turns off after a while and
+        # turning the encoder wakes it up.
+        print("Monitoring start")
+        self.start_time = time.ticks_ms()
+        self.encoder.clear()
+        next_summary = HRA.MONITOR_WINDOW
+        summary = None
+        display_on = time.ticks_ms()
         
-        # Check for out of bounds values.
-        if normalized_sample > 1:
-            normalized_sample = 1		# Clamp value to max
-            self.lts_max = sample_value	# Move max to value
-        if normalized_sample < 0:
-            normalized_sample = 0
-            self.lts_min = sample_value
+        while True:
+            event = self.encoder.get_event()
+            if event in ("short", "long"):
+                await self.stop()
+                break
+            if event is not None:
+                if display_on is None:
+                    self.OLED.poweron()
+                display_on = time.ticks_ms()
             
-        return normalized_sample
-    
-    
-    # Check if sample value is peak
-    def is_peak(self, sample_value): # -----------------------------------------
-        # Filter noisy samples with last 10 sample average.
-        sample_value = self.last_samples_avg_10.get()
+            # Window summaries are timed by samples, like the PPIs.
+            now = self.detector.now()
+            if now >= next_summary:
+                next_summary += HRA.MONITOR_WINDOW
+                summary = self.window.summary(now)
+                if summary is not None and self.on_summary:
+                    self.on_summary(summary)
+            
+            if display_on is not None:
+                if time.ticks_diff(time.ticks_ms(), display_on) > HRA.DISPLAY_TIMEOUT:
+                    self.OLED.poweroff()
+                    display_on = None
+                else:
+                    self.OLED.fill(0)
+                    self.OLED.text("MONITORING", 0, 0)
+                    self.OLED.text(f"BPM:{self.detector.bpm}", 0, 16)
+                    self.OLED.text(f"Q:{self.detector.quality.index}", 87, 16)
+                    if summary:
+                        self.OLED.text(f"RMSSD: {summary['rmssd']:.0f}ms", 0, 32)
+                        self.OLED.text(f"SDNN: {summary['sdnn']:.0f}ms", 0, 44)
+                    # Time in current window
+                    elapsed = (now - next_summary + HRA.MONITOR_WINDOW) // 1000
+                    self.OLED.text(f"{elapsed}/{HRA.MONITOR_WINDOW // 1000}s", 0, 56)
+                    self.OLED.show()
+            self.memory.idle_collect()
+            await asyncio.sleep_ms(200)
         
-        # Check if sample is over treshold.
-        if sample_value > HRA.TRESHOLD:
-            # If no max value or value is bigger than max.
-            if self.max_value is None or sample_value > self.max_value:
-                self.max_value = sample_value	# Make value new max.
-        # Check if value drops below treshold.
-        elif sample_value <  HRA.TRESHOLD and self.max_value is not None:
-            self.max_value = None		# Reset max value for new peak
-            return True					# Return true
-        return False
-
-
-    # Update all rolling averages with new value
-    def update_rolling_averages(self, val): # ----------------------------------
-        self.last_samples_avg_10.update(val)	# Last 10 sample average value
-        self.last_samples_avg_40.update(val)	# Last 40 sample average value
+        if display_on is None:
+            self.OLED.poweron()
+        return None
 
 
     # Stop program
-    def stop(self): # ----------------------------------------------------------
+    async def stop(self): # ----------------------------------------------------
         # Print total samples recorded.
         # DEBUG
-        print(f"Total samples recorded: {self.sample_n}")
+        print(f"Total samples recorded: {self.detector.sample_n}")
         # Print total time elapsed.
         # DEBUG
         time_since_start = time.ticks_diff(time.ticks_ms(), self.start_time) / 1000
         print(f"Total time elapsed: {time_since_start}s")
         
         # Stop timer.
-        self.sensor_timer.deinit()
-        # Stop thread 1.
-        self.thread_running = False
-        # Empty sensor fifo
-        self.sensor.reset_fifo()
+        self.stop_timer()
+        # Stop worker. It empties the sensor fifo once it has stopped.
+        await self.worker.command(SensorWorker.STOP)
+        self.last_stop = time.ticks_ms()
+        # Finish capture file.
+        if self.capture:
+            await self.worker.command(SensorWorker.CAPTURE, None)
+            self.capture.close()
+            self.capture = None
+        # Restore GC settings and print heap usage of the recording.
+        # DEBUG
+        heap = self.memory.end_session()
+        print(f"Heap free: {heap['free']} B, lowest {heap['min_free']} B, "
+              f"largest block {heap['largest']} B, "
+              f"{heap['collections']} idle collections")
 
 
 if __name__ == "__main__":
-    hra = HRA()
-    hra.start_recording(mode=1)
+    # SYNTH = True runs on a synthetic signal without a finger on the sensor.
+    SYNTH = False
+    adc = None
+    if SYNTH:
+        from ppgsynth import PPGSynth
+        adc = PPGSynth(hr=75)
+    hra = HRA(adc=adc)
+    asyncio.run(hra.start_recording(mode=1))
@@ -1,18 +1,9 @@
-from machine import Pin, I2C, ADC
-from piotimer import Piotimer
-from fifo import Fifo
-import ssd1306
 import time
 import math
 import json
+import asyncio
 import historian
 
-# OLED Display Setup
-i2c = I2C(1, sda=Pin(14), scl=Pin(15), freq=400000)
-oled = ssd1306.SSD1306_I2C(128, 64, i2c)
-
-button = Pin(12, Pin.IN, Pin.PULL_UP)
-
 #Test values
 # peaks need to be RR intervals (in milliseconds).
 #peaks =  [820, 830, 840, 830, 840, 850, 860, 870, 860, 850]
@@ -56,7 +47,7 @@ def calculate_hrv(peaks):
         "sdnn": round(sdnn, 1)
     }
 
-def display_results(results):
+def display_results(oled, results):
     oled.fill(0)
     
     # Display header and each HRV metric
@@ -68,19 +59,28 @@ def display_results(results):
     
     oled.show()
 
-def analyze_and_display(peaks, historian_instance, networker=None):
-    global button
+async def analyze_and_display(peaks, historian_instance, oled, encoder, networker=None,
+                              capture_file=None, heap=None):
+    # oled is the shared display and encoder the rotary encoder used for
+    # closing the results screen. capture_file is the raw sample capture of
+    # the recording and heap the heap stats of the recording session, both
+    # saved with the results.
     # Calculate HRV metrics
     results = calculate_hrv(peaks)
     
     if results:
+        if capture_file:
+            results["capture"] = capture_file
+        if heap:
+            results["heap_min_free"] = heap["min_free"]
+            results["heap_largest"] = heap["largest"]
         if networker:
             # Save results to history and display on screen
             historian_instance.add_measurement(results, networker=networker)
         else:
             # Save results to history and display on screen
             historian_instance.add_measurement(results)
-        display_results(results)
+        display_results(oled, results)
         
         # Print to console for debugging
         print("\nHRV Analysis Results:")
@@ -94,14 +94,17 @@ def analyze_and_display(peaks, historian_instance, networker=None):
         oled.text("Not enough data", 0, 32)
         oled.show()
     
-    # Wait for user to press and release button to continue
-    while True:
-        if button.value() == 1:
-            time.sleep(0.05)
-            if button.value() == 0:
-                return
+    # Wait for user to click the button to continue
+    encoder.clear()
+    while await encoder.next_event() not in ("short", "long"):
+        pass
 
 # --- Test Entry Point ---
 
 if __name__ == "__main__":
-    analyze_and_display(peaks)
\ No newline at end of file
+    from display import Display
+    from peripherals import RotaryEncoder
+    peaks =  [820, 830, 840, 830, 840, 850, 860, 870, 860, 850]
+    oled = Display()
+    asyncio.run(analyze_and_display(peaks, historian.Historian(oled), oled,
+                                    RotaryEncoder(10, 11, 12)))
\ No newline at end of file
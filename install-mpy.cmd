@@ -0,0 +1,16 @@
+@echo off
+@rem Same as install.cmd but installs precompiled .mpy files from build/.
+python tools/build.py
+if errorlevel 1 exit /b 1
+start "mpremote.webserver" python -m http.server
+@rem Extract comport name where pico is connected
+for /f "tokens=1 delims= " %%a in ('python -m mpremote connect list ^| find "2e8a:0005"') do set comport=%%a
+echo Device: %comport%
+timeout /t 2 /nobreak
+@rem Remove sources of a previous install. MicroPython would import them
+@rem instead of the .mpy files.
+python -m mpremote connect %comport% run build/remove_sources.py
+@rem Run mpremote
+python -m mpremote connect %comport% mip install --target / http://localhost:8000/build/
+@rem The following line terminates all processes with mpremote.webserver as the window title.
+taskkill /fi "WINDOWTITLE eq mpremote.webserver"
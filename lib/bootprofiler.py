@@ -0,0 +1,95 @@
+import os
+import time
+import gc
+
+"""bootprofiler library measures where the boot time and RAM go. Call mark()
+after each import or startup step and report() when the device is ready.
+
+Profiling collects garbage at every mark and writes to flash, so it is off
+unless the SENTINEL file exists on the device:
+
+    mpremote fs touch :/profile_boot
+"""
+
+SENTINEL = "/profile_boot"
+
+
+def profiling_requested():
+    """True if the SENTINEL file exists."""
+    try:
+        os.stat(SENTINEL)
+        return True
+    except OSError:
+        return False
+
+class BootProfiler:
+    """
+    BootProfiler records time and RAM used between marks.
+
+    PARAMS:
+    filename(str): File where report() writes the results.
+    enabled(bool: True): If False, marks are not recorded.
+    """
+    def __init__(self, filename="/boot_profile.txt", enabled=True):
+        self.filename = filename
+        self.enabled = enabled
+        self.records = []				# (name, time(us), RAM(bytes))
+        self.boot_start = time.ticks_us()
+        self.last_free = 0
+        if enabled:
+            gc.collect()
+            self.last_free = gc.mem_free()
+        self.last_time = time.ticks_us()
+
+    def mark(self, name):
+        """Record time and RAM used since last mark."""
+        if not self.enabled:
+            return
+        elapsed = time.ticks_diff(time.ticks_us(), self.last_time)
+        # Collect so that only RAM still in use is counted. Time spent
+        # collecting is left out of the next step.
+        gc.collect()
+        free = gc.mem_free()
+        self.records.append((name, elapsed, self.last_free - free))
+        self.last_free = free
+        self.last_time = time.ticks_us()
+
+    def report(self):
+        """Print results and write them to file."""
+        if not self.enabled:
+            return
+        total = time.ticks_diff(time.ticks_us(), self.boot_start)
+        lines = ["step\tms\tbytes"]
+        for name, elapsed, used in self.records:
+            lines.append(f"{name}\t{elapsed / 1000:.1f}\t{used}")
+        lines.append(f"total\t{total / 1000:.1f}\t{gc.mem_free()} free")
+
+        print("Boot profile:")
+        for line in lines:
+            print(line)
+        try:
+            with open(self.filename, "w") as f:
+                for line in lines:
+                    f.write(line)
+                    f.write("\n")
+        except Exception as e:
+            print("Error writing boot profile:", e)
+
+
+class LazyModule:
+    """
+    LazyModule imports a module on first attribute access. Used for modules
+    that are needed rarely so that they don't slow down boot.
+
+    PARAMS:
+    name(str): Module name.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            print(f"Loading {self._name}...")
+            self._module = __import__(self._name)
+        return getattr(self._module, attr)
@@ -0,0 +1,191 @@
+import os
+import struct
+
+"""capture library saves raw PPG samples to flash so that recordings can be
+replayed later, for example with detector.compare.
+
+File format:
+
+    b"PPG" version(1 byte) sample_frequency(uint16)
+    blocks of BLOCK_SIZE bytes:
+        sample_count(uint16) first_sample(uint16) data_length(uint16)
+        deltas(zigzag varint)... zero padding
+
+Blocks are independent, so a capture cut by power loss can be read up to the
+last full block. Samples of a PPG signal change little between samples at
+250 Hz, so most deltas take one byte.
+"""
+
+MAGIC = b"PPG"
+VERSION = 1
+BLOCK_SIZE = 512
+BLOCK_HEADER = 6
+MAX_VARINT = 3				# 16 bit samples have 17 bit zigzag deltas
+DIRECTORY = "/captures"
+MAX_CAPTURES = 5
+
+
+class CaptureWriter:
+    """
+    CaptureWriter encodes samples into two block buffers. put() is called
+    from the sampling core and never touches the file system. When a block
+    is full the buffers are swapped, and flush() on the other core writes the
+    full block to the file. If both buffers are full, samples are dropped
+    and counted instead of waiting for flash.
+
+    PARAMS:
+    filename(str): Capture file.
+    sample_frequency(int): Sample frequency of the samples(Hz).
+    """
+    def __init__(self, filename, sample_frequency=250):
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC + struct.pack("<BH", VERSION, sample_frequency))
+        self.buffers = (bytearray(BLOCK_SIZE), bytearray(BLOCK_SIZE))
+        self.active = 0				# Buffer put() writes to
+        self.full = -1				# Buffer waiting for flush, -1 if none
+        self.pos = BLOCK_HEADER		# Write position in active buffer
+        self.count = 0				# Samples in active block
+        self.previous = 0
+        self.samples = 0			# Samples captured
+        self.dropped = 0			# Samples lost because flash was too slow
+        self.blocks = 0				# Blocks written to file
+
+    def put(self, sample):
+        """Add one sample. Safe to call from the sampling core."""
+        buf = self.buffers[self.active]
+        if self.count == 0:
+            # First sample of a block is stored in the header.
+            buf[2] = sample & 0xFF
+            buf[3] = sample >> 8
+        else:
+            delta = sample - self.previous
+            value = (delta << 1) if delta >= 0 else ((-delta << 1) - 1)
+            pos = self.pos
+            while value > 0x7F:
+                buf[pos] = (value & 0x7F) | 0x80
+                value >>= 7
+                pos += 1
+            buf[pos] = value
+            self.pos = pos + 1
+        self.previous = sample
+        self.count += 1
+        self.samples += 1
+        if self.pos > BLOCK_SIZE - MAX_VARINT:
+            self._swap()
+
+    def _swap(self):
+        # Finish active block and continue in the other buffer.
+        if self.full != -1:
+            # Last full block is not written yet. Start this block again.
+            self.dropped += self.count
+            self.samples -= self.count
+            self.pos = BLOCK_HEADER
+            self.count = 0
+            return
+        buf = self.buffers[self.active]
+        self._finish(buf)
+        self.full = self.active
+        self.active ^= 1
+        self.pos = BLOCK_HEADER
+        self.count = 0
+
+    def _finish(self, buf):
+        # Write block header and clear padding.
+        length = self.pos - BLOCK_HEADER
+        buf[0] = self.count & 0xFF
+        buf[1] = self.count >> 8
+        buf[4] = length & 0xFF
+        buf[5] = length >> 8
+        for i in range(self.pos, BLOCK_SIZE):
+            buf[i] = 0
+
+    def flush(self):
+        """Write full block to file if there is one. Call from the core that
+        isn't sampling."""
+        if self.full != -1:
+            self.file.write(self.buffers[self.full])
+            self.blocks += 1
+            self.full = -1
+
+    def close(self):
+        """Write remaining samples and close file. Sampling must be stopped
+        before calling."""
+        self.flush()
+        if self.count:
+            buf = self.buffers[self.active]
+            self._finish(buf)
+            self.file.write(buf)
+            self.blocks += 1
+            self.count = 0
+        self.file.close()
+        print(f"Captured {self.samples} samples to {self.filename}, "
+              f"{self.blocks * BLOCK_SIZE} B, {self.dropped} dropped")
+
+
+class CaptureReader:
+    """
+    CaptureReader reads samples from a capture file.
+
+    PARAMS:
+    filename(str): Capture file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            header = f.read(len(MAGIC) + 3)
+        if header[:len(MAGIC)] != MAGIC or header[len(MAGIC)] != VERSION:
+            raise ValueError("Unknown capture format")
+        self.sample_frequency = struct.unpack("<H", header[len(MAGIC) + 1:])[0]
+
+    def blocks(self):
+        """Yield blocks as lists of samples."""
+        with open(self.filename, "rb") as f:
+            f.read(len(MAGIC) + 3)
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if len(block) < BLOCK_SIZE:
+                    return
+                count, sample, length = struct.unpack("<HHH", block[:BLOCK_HEADER])
+                samples = [sample]
+                pos = BLOCK_HEADER
+                end = BLOCK_HEADER + length
+                while pos < end:
+                    value = 0
+                    shift = 0
+                    while True:
+                        byte = block[pos]
+                        pos += 1
+                        value |= (byte & 0x7F) << shift
+                        if not byte & 0x80:
+                            break
+                        shift += 7
+                    sample += (value >> 1) if not value & 1 else -((value + 1) >> 1)
+                    samples.append(sample)
+                yield samples[:count]
+
+    def samples(self):
+        """Yield samples one at a time."""
+        for block in self.blocks():
+            for sample in block:
+                yield sample
+
+    def read(self):
+        """Return all samples as a list."""
+        samples = []
+        for block in self.blocks():
+            samples.extend(block)
+        return samples
+
+
+def new_capture_file(name):
+    """Return path for a new capture. Old captures are removed so that only
+    MAX_CAPTURES are kept."""
+    try:
+        files = sorted(os.listdir(DIRECTORY))
+    except OSError:
+        os.mkdir(DIRECTORY)
+        files = []
+    for old in files[:max(0, len(files) - MAX_CAPTURES + 1)]:
+        os.remove(DIRECTORY + "/" + old)
+    return f"{DIRECTORY}/{name}.ppg"
@@ -0,0 +1,272 @@
+from rollingaverage import RollingAverage, IntRollingAverage
+from filo import Filo
+from quality import SignalQuality
+from filters import BandPass, MotionDetector
+import kernels
+import array
+
+"""detector library has the heart beat detection algorithm of HRA without any
+hardware dependencies, so that it can also be run over recorded data.
+
+Time is counted from samples, one sample is 1000 / sample_frequency ms.
+"""
+
+class PeakDetector:
+    """
+    PeakDetector finds heart beats from raw PPG sensor samples and collects
+    peak-to-peak intervals.
+
+    By default the whole per-sample path is integers: samples are normalized
+    to Q15 (0-32767) and averaged with integer rolling averages, so no float
+    objects are allocated per sample. fixed_point=False runs the original
+    float algorithm, which is kept as the reference.
+
+    PARAMS:
+    fixed_point(bool: True): Use integer signal path.
+    threshold(float): Peak detection threshold, 0-1 of normalized signal.
+    cooldown(int): Time after an artifact when new artifacts are not counted(ms).
+    sample_frequency(int): Sample frequency of the data(Hz).
+    target_error(float): Target relative RMSSD error for SignalQuality.
+    filtering(bool: True): Band-pass and motion blanking.
+    """
+    # ALGORITHM PARAMETERS
+    COOLDOWN = 500								# Total cooldown(ms)
+    TRESHOLD = 0.7								# Peak detection treshold
+    SAMPLE_FREQUENCY = 250						# HR sensor sample frequency
+    MIN_PPI = 300								# Shorter intervals are echoes(ms)
+    MAX_PPI = 1700								# Longer intervals are missed beats(ms)
+    ARTIFACT_LOW = 10000						# Raw values outside these are
+    ARTIFACT_HIGH = 60000						# movement artifacts
+    FILTER_LOW = 0.5							# Band-pass cutoffs(Hz)
+    FILTER_HIGH = 5.0
+
+    def __init__(self, fixed_point=True, threshold=None, cooldown=None,
+                 sample_frequency=None, target_error=None, filtering=True):
+        self.fixed_point = fixed_point
+        self.filtering = filtering
+        self.quality = SignalQuality(target_error)		# Signal quality index
+        if threshold is None:
+            threshold = PeakDetector.TRESHOLD
+        self.cooldown = cooldown or PeakDetector.COOLDOWN
+        self.sample_frequency = sample_frequency or PeakDetector.SAMPLE_FREQUENCY
+        # Threshold in the same units as normalized samples.
+        if fixed_point:
+            self.threshold = int(threshold * kernels.Q15_ONE)
+        else:
+            self.threshold = threshold
+        self.debug = False						# Print peaks and artifacts
+        self.keep_peaks = True					# Collect all PPIs to peaks
+        self.window = None						# HRVWindow for sliding window HRV
+        self.reset()
+
+    def configure(self, threshold=None, cooldown=None, filtering=None):
+        """Change algorithm parameters in place. Arguments that are None are
+        kept. Changing filtering drops the calibration, since stored samples
+        were filtered the old way."""
+        if threshold is not None:
+            if self.fixed_point:
+                self.threshold = int(threshold * kernels.Q15_ONE)
+            else:
+                self.threshold = threshold
+        if cooldown is not None:
+            self.cooldown = cooldown
+        if filtering is not None and filtering != self.filtering:
+            self.filtering = filtering
+            self.reset()
+
+    def reset(self, warm=False):
+        """Reset algorithm state for a new recording. With warm=True the
+        calibration of the last session or pre-sampling is kept: raw sample
+        history, min-max bounds, signal averages and PPI average."""
+        RollAvg = IntRollingAverage if self.fixed_point else RollingAverage
+        self.max_value = None							# Max value of current peak
+        self.sample_n = 0								# Samples processed
+        self.total_n = 0								# All samples, artifacts included
+        self.peaks = []									# All recorded peaks
+        self.last_peak = None 							# Last peak time(ms)
+        self.last_artifact_time = -self.cooldown - 1	# Last artifact time(ms)
+        self.artifact_count = 0							# Total amount of artifacts
+        self.quality.reset()
+        if warm and self.is_calibrated():
+            return
+        self.last_samples_avg_10 = RollAvg(size=10)		# Rolling average of last 10 samples
+        self.last_samples_avg_40 = RollAvg(size=40)		# Rolling average of last 40 samples
+        self.last_samples_raw = Filo(self.sample_frequency, typecode = "i")# Last second of samples
+        self.bpm = 0									# Current BPM
+        self.bounds = array.array("i", [0, 0])			# Last second min and max
+        self.ppi_roll_avg = RollAvg(size=10)			# Rolling average of last 10 PPI(ms)
+        self.ppi_avg = 0
+        self.band_pass = BandPass(PeakDetector.FILTER_LOW, PeakDetector.FILTER_HIGH,
+                                  self.sample_frequency)
+        self.motion = MotionDetector(self.sample_frequency)
+
+    def is_calibrated(self):
+        """True if there is at least a second of raw samples to warm start
+        from."""
+        return (hasattr(self, "last_samples_raw")
+                and self.last_samples_raw.dc >= self.sample_frequency)
+
+    def now(self):
+        """Time since start from sample count(ms)."""
+        # Split so that the product stays a small int in long recordings.
+        seconds, samples = divmod(self.total_n, self.sample_frequency)
+        return seconds * 1000 + samples * 1000 // self.sample_frequency
+
+    def fill(self, sample):
+        """Store sample for min-max without detecting peaks. Used while
+        waiting for the pulse."""
+        if self.filtering:
+            self.motion.update(sample)
+            sample = self.band_pass.update(sample)
+        self.last_samples_raw.put(sample)
+
+    def process(self, sample):
+        """Process one raw sample. Returns accepted PPI(ms) if the sample
+        completed a heart beat, otherwise 0."""
+        self.total_n += 1
+        now = self.now()
+
+        # Check for movement artifacts
+        if sample < PeakDetector.ARTIFACT_LOW or sample > PeakDetector.ARTIFACT_HIGH:
+            self.artifact(now)
+            return 0
+
+        if self.filtering:
+            moving = self.motion.update(sample)
+            sample = self.band_pass.update(sample)
+            if moving:
+                # Filter keeps running but nothing is detected. Interval
+                # over the movement isn't valid.
+                self.artifact(now)
+                self.last_peak = None
+                self.max_value = None
+                return 0
+
+        self.last_samples_raw.put(sample)	# Store sample to filo.
+
+        sample = self.normalize(sample)		# Normalize raw sample.
+        self.update_rolling_averages(sample)	# Update rolling averages.
+
+        self.sample_n += 1					# Keep track of total recorded samples
+
+        # Check for peak.
+        if not self.is_peak(sample):
+            return 0
+        if self.debug:
+            print("PEAK")
+        # First peak after start or movement only starts the interval.
+        if self.last_peak is None:
+            self.last_peak = now
+            return 0
+        interval = now - self.last_peak		# Time since last peak
+        self.last_peak = now
+
+        # Filter heart beat echo and impossible heart rates.
+        if interval < PeakDetector.MIN_PPI or interval > PeakDetector.MAX_PPI:
+            self.quality.beat(0, self.ppi_avg)
+            return 0
+        self.quality.beat(interval, self.ppi_avg)
+        if self.keep_peaks:
+            self.peaks.append(interval)
+        if self.window is not None:
+            self.window.add(interval, now)
+        # Calculate current PPI and BPM
+        self.ppi_avg = self.ppi_roll_avg.update(interval)
+        self.bpm = int(60000 // self.ppi_avg)
+        return interval
+
+    def artifact(self, now):
+        """Count artifact, once per cooldown."""
+        if now - self.last_artifact_time > self.cooldown:
+            if self.debug:
+                print("Pulse artifact")
+            self.artifact_count += 1
+            self.last_artifact_time = now
+            self.quality.artifact()
+
+    # Find min and max values of recent values
+    def find_min_max(self):
+        # Max and min functions are slow. But this function is called only once
+        # per second.
+        self.bounds[1] = max(self.last_samples_raw.data)
+        self.bounds[0] = min(self.last_samples_raw.data)
+        self.quality.amplitude(self.bounds[1] - self.bounds[0])
+
+    # Normalize any sample value to 0-1 (float) or 0-32767 (fixed point)
+    def normalize(self, sample_value):
+        # Find min and max values every second.
+        if self.sample_n % self.sample_frequency == 0:
+            self.find_min_max()
+        if self.fixed_point:
+            return kernels.normalize_q15(sample_value, self.bounds)
+
+        # Apply min max normalization to raw sample value.
+        normalized_sample = (sample_value - self.bounds[0]) / (self.bounds[1] - self.bounds[0])
+
+        # Check for out of bounds values.
+        if normalized_sample > 1:
+            normalized_sample = 1			# Clamp value to max
+            self.bounds[1] = sample_value	# Move max to value
+        if normalized_sample < 0:
+            normalized_sample = 0
+            self.bounds[0] = sample_value
+        return normalized_sample
+
+    # Check if sample value is peak
+    def is_peak(self, sample_value):
+        # Filter noisy samples with last 10 sample average.
+        sample_value = self.last_samples_avg_10.get()
+
+        # Check if sample is over treshold.
+        if sample_value > self.threshold:
+            # If no max value or value is bigger than max.
+            if self.max_value is None or sample_value > self.max_value:
+                self.max_value = sample_value	# Make value new max.
+        # Check if value drops below treshold.
+        elif sample_value < self.threshold and self.max_value is not None:
+            self.max_value = None		# Reset max value for new peak
+            return True					# Return true
+        return False
+
+    # Update all rolling averages with new value
+    def update_rolling_averages(self, val):
+        self.last_samples_avg_10.update(val)	# Last 10 sample average value
+        self.last_samples_avg_40.update(val)	# Last 40 sample average value
+
+    def level(self):
+        """Current smoothed signal level as float 0-1. For display only."""
+        value = self.last_samples_avg_10.get()
+        if self.fixed_point:
+            return value / kernels.Q15_ONE
+        return value
+
+
+def compare(samples, tolerance=8):
+    """Run fixed point and float detectors over the same raw samples. Returns
+    True if they find the same number of beats and every PPI is within
+    tolerance(ms)."""
+    results = []
+    for fixed_point in (True, False):
+        detector = PeakDetector(fixed_point=fixed_point)
+        for sample in samples[:detector.sample_frequency]:
+            detector.fill(sample)
+        for sample in samples[detector.sample_frequency:]:
+            detector.process(sample)
+        results.append(detector.peaks)
+    fixed, reference = results
+    worst = max((abs(a - b) for a, b in zip(fixed, reference)), default=0)
+    print(f"Beats: fixed {len(fixed)}, float {len(reference)}. Largest PPI difference {worst} ms")
+    return len(fixed) == len(reference) and worst <= tolerance
+
+
+if __name__ == "__main__":
+    import sys
+    # Recording file is a capture from flash or has one raw sample per line.
+    filename = sys.argv[1] if len(sys.argv) > 1 else "capture_250Hz_01.txt"
+    if filename.endswith(".ppg"):
+        from capture import CaptureReader
+        recording = CaptureReader(filename).read()
+    else:
+        with open(filename) as f:
+            recording = [int(line) for line in f if line.strip()]
+    compare(recording)
@@ -0,0 +1,49 @@
+from machine import Pin, I2C
+import ssd1306
+import framebuf
+
+class Display(ssd1306.SSD1306_I2C):
+    """
+    Display is the one OLED object of the device. Create it once and pass it
+    to everything that draws so that there is only one framebuffer and the
+    controller is initialized once.
+
+    PARAMS:
+    sda(int): GPIO pin of I2C SDA.
+    scl(int): GPIO pin of I2C SCL.
+    compositing(bool: False): Allocate an off-screen canvas for composing
+    frames. Costs another 1 KB of RAM.
+    """
+    WIDTH = 128
+    HEIGHT = 64
+
+    def __init__(self, sda=14, scl=15, compositing=False):
+        i2c = I2C(1, sda=Pin(sda), scl=Pin(scl), freq=400000)
+        super().__init__(Display.WIDTH, Display.HEIGHT, i2c)
+        self.canvas = None
+        if compositing:
+            self.enable_compositing()
+
+    def enable_compositing(self):
+        """Allocate off-screen canvas. Draw on display.canvas and call
+        present() to show the finished frame."""
+        if self.canvas is None:
+            self.canvas_buffer = bytearray(len(self.buffer))
+            self.canvas = framebuf.FrameBuffer(self.canvas_buffer, Display.WIDTH,
+                                               Display.HEIGHT, framebuf.MONO_VLSB)
+
+    def present(self):
+        """Copy canvas to display buffer and show it."""
+        self.buffer[:] = self.canvas_buffer
+        self.show()
+
+    def show_pages(self, first, last):
+        """Send only 8 pixel high pages first-last to the display."""
+        self.write_cmd(0x21)	# Column address
+        self.write_cmd(0)
+        self.write_cmd(Display.WIDTH - 1)
+        self.write_cmd(0x22)	# Page address
+        self.write_cmd(first)
+        self.write_cmd(last)
+        view = memoryview(self.buffer)
+        self.write_data(view[first * Display.WIDTH:(last + 1) * Display.WIDTH])
@@ -1,4 +1,5 @@
 import array
+import kernels
 
 
 class Filo:
@@ -15,12 +16,17 @@ class Filo:
         self.head = 0
         self.size = size
         self.dc = 0
+        # 32 bit int filos use the ring buffer kernel.
+        self.use_kernel = typecode == 'i'
         
     def put(self, value):
         """Put one item into the filo."""
-        nh = (self.head + 1) % self.size
-        self.data[self.head] = value
-        self.head = nh
+        if self.use_kernel:
+            self.head = kernels.ring_put(self.data, self.head, self.size, value)
+        else:
+            nh = (self.head + 1) % self.size
+            self.data[self.head] = value
+            self.head = nh
         """Dropped count probably not needed."""
         self.dc = self.dc + 1
             
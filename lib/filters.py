@@ -0,0 +1,119 @@
+import array
+import math
+import kernels
+
+"""filters library has the streaming filters that clean the raw PPG signal
+before peak detection. Coefficients are calculated once with floats, the
+filtering itself is integer kernels.
+
+Samples are 16 bit read_u16 values. The RP2040 ADC is 12 bits, so they are
+shifted down to 12 bits first without losing anything. That keeps every
+product in the kernels well inside 31 bit small ints.
+"""
+
+INPUT_SHIFT = 4			# read_u16 value to 12 bit ADC value
+
+
+def dc_block_state(cutoff, sample_frequency):
+    """State for kernels.dc_block. One pole high-pass at cutoff(Hz)."""
+    a = math.exp(-2 * math.pi * cutoff / sample_frequency)
+    return array.array("i", [round(a * 32768), 0, 0, 0])
+
+
+def lowpass_state(cutoff, sample_frequency):
+    """State for kernels.biquad. Second order Butterworth low-pass at
+    cutoff(Hz). b coefficients are adjusted so that DC gain is exactly 1."""
+    w0 = 2 * math.pi * cutoff / sample_frequency
+    alpha = math.sin(w0) / math.sqrt(2)
+    a0 = 1 + alpha
+    a1 = round(-2 * math.cos(w0) / a0 * 16384)
+    a2 = round((1 - alpha) / a0 * 16384)
+    b_sum = 16384 + a1 + a2
+    b0 = b_sum // 4
+    b1 = b_sum - 2 * b0
+    return array.array("i", [b0, b1, b0, a1, a2, 0, 0, 0, 0, 0])
+
+
+class BandPass:
+    """
+    Band-pass filter for the PPG signal. Removes baseline wander from
+    breathing and movement with a high-pass and sensor noise with a low-pass.
+    Output is signed, around zero, in 12 bit ADC units.
+
+    High-pass is two one pole stages. A biquad with 0.5 Hz cutoff at 250 Hz
+    has its poles too close to 1 for 14 bit coefficients. One stage alone
+    lets too much breathing(0.2-0.3 Hz) through.
+
+    PARAMS:
+    low(float): High-pass cutoff(Hz).
+    high(float): Low-pass cutoff(Hz).
+    sample_frequency(int): Sample frequency(Hz).
+    """
+    def __init__(self, low=0.5, high=5.0, sample_frequency=250):
+        self.dc_state = dc_block_state(low, sample_frequency)
+        self.dc_state_2 = dc_block_state(low, sample_frequency)
+        self.lp_state = lowpass_state(high, sample_frequency)
+        self.primed = False
+
+    def prime(self, sample):
+        """Start from sample without a step response."""
+        self.dc_state[1] = sample >> INPUT_SHIFT
+        self.primed = True
+
+    def update(self, sample):
+        """Filter one raw sample. Returns filtered value."""
+        if not self.primed:
+            self.prime(sample)
+        value = kernels.dc_block(self.dc_state, sample >> INPUT_SHIFT)
+        value = kernels.dc_block(self.dc_state_2, value)
+        return kernels.biquad(self.lp_state, value)
+
+
+class MotionDetector:
+    """
+    MotionDetector finds movement from the slope of the raw signal. Slope is
+    compared to its own long-term average, so it works with any sensor
+    amplitude. After movement peaks are blanked for blank time.
+
+    PARAMS:
+    sample_frequency(int): Sample frequency(Hz).
+    blank_ms(int): Blanking time after movement(ms).
+    """
+    FACTOR = 8				# Movement when slope is over 8 * average slope
+    MIN_SLOPE = 16			# and over this(12 bit ADC units per sample)
+    AVG_SHIFT = 6			# Average over about 64 samples
+    LEARN_SAMPLES = 64		# Samples before detecting
+    BLANK_MS = 500
+
+    def __init__(self, sample_frequency=250, blank_ms=None):
+        blank_ms = blank_ms or MotionDetector.BLANK_MS
+        self.blank_samples = blank_ms * sample_frequency // 1000
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.slope_sum = 0			# Average slope << AVG_SHIFT
+        self.learn_n = 0
+        self.blank_n = 0			# Samples left to blank
+
+    def update(self, sample):
+        """Update with one raw sample. Returns True while peaks should be
+        blanked."""
+        value = sample >> INPUT_SHIFT
+        if self.last is None:
+            self.last = value
+            return False
+        slope = abs(value - self.last)
+        self.last = value
+
+        if self.learn_n < MotionDetector.LEARN_SAMPLES:
+            self.learn_n += 1
+        elif (slope > MotionDetector.MIN_SLOPE
+                and (slope << MotionDetector.AVG_SHIFT) > MotionDetector.FACTOR * self.slope_sum):
+            self.blank_n = self.blank_samples
+        if self.blank_n:
+            # Movement isn't learned to the average.
+            self.blank_n -= 1
+            return True
+        self.slope_sum += slope - (self.slope_sum >> MotionDetector.AVG_SHIFT)
+        return False
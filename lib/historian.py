@@ -1,12 +1,16 @@
+import os
 import time
 import json
+import asyncio
 
 class Historian:
     # Class to manage saved HRV measurements
-    def __init__(self):
+    def __init__(self, display):
+        self.oled = display
         self.saved_measurements = []
         self.filename = "/history.txt"
         self.max_entries = 50  # Keep only the last 50 measurements
+        self.file_entries = 0  # Measurements in file, trimmed at 2 * max_entries
         self.load_history()
 
     def create_history(self):
@@ -19,21 +23,52 @@ class Historian:
         except Exception as e:
             print("Error creating history file:", e)
 
+    def read_last_lines(self):
+        # Return newest max_entries lines of the history file. Measurements
+        # are appended in time order, so they are the last lines. Only
+        # max_entries lines are kept in RAM however long the file is.
+        lines = []
+        total = 0
+        with open(self.filename, "r") as f:
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                    total += 1
+                    if len(lines) > self.max_entries:
+                        lines.pop(0)
+        self.file_entries = total
+        return lines
+
     def load_history(self):
         # Load saved measurements from file
         self.saved_measurements = []
         try:
-            with open(self.filename, "r") as f:
-                for line in f:
-                    if line.strip():
-                        self.saved_measurements.append(json.loads(line))
+            self.saved_measurements = [json.loads(line) for line in self.read_last_lines()]
         except Exception:
             self.saved_measurements = []
             self.create_history()
         
         # Sort from newest to oldest
         self.saved_measurements.sort(key=lambda x: x["time"], reverse=True)
+
+    def trim_file(self):
+        # Rewrite history file with the newest max_entries measurements.
+        # Written to a temporary file first so that power loss doesn't lose
+        # the history.
+        try:
+            lines = self.read_last_lines()
+            with open(self.filename + ".tmp", "w") as f:
+                for line in lines:
+                    f.write(line)
+            os.rename(self.filename + ".tmp", self.filename)
+            self.file_entries = len(lines)
+        except Exception as e:
+            print("Error trimming history:", e)
             
+    def unload(self):
+        # Free loaded measurements. They are loaded again when needed.
+        self.saved_measurements = []
+
     def add_measurement(self, measurement, networker=None):
 #         measurement = json.loads(measurement)
         # Ensure the measurement has a timestamp
@@ -77,26 +112,36 @@ class Historian:
             with open(self.filename, "a") as f:
                 json.dump(measurement, f)
                 f.write("\n")
+            self.file_entries += 1
         except Exception as e:
             print("Error appending to history:", e)
 
-        self.load_history()
+        # Monitoring adds a measurement every window, so the file is trimmed
+        # back to max_entries when it has grown to twice that.
+        if self.file_entries > 2 * self.max_entries:
+            self.trim_file()
 
+        # Keep loaded history up to date. Unloaded history is loaded when
+        # the history menu is opened, so long monitoring sessions don't
+        # read the whole file for every window.
+        if self.saved_measurements:
+            self.load_history()
+
+        # Loaded history is newest first.
         if len(self.saved_measurements) > self.max_entries:
-            self.saved_measurements = self.saved_measurements[-self.max_entries:]
+            self.saved_measurements = self.saved_measurements[:self.max_entries]
 
-    def run_menu(self, menu_manager):
+    async def run_menu(self, menu_manager):
         # Display the measurement history menu
         self.load_history()
-        oled = menu_manager.oled
+        oled = self.oled
         encoder = menu_manager.encoder
-        print("Event from encoder:", encoder.check_button_event())
 
         if not self.saved_measurements:
             oled.fill(0)
             oled.text("No measurements!", 2, 25)
             oled.show()
-            time.sleep(2)
+            await asyncio.sleep(2)
             return
 
         selected = 0
@@ -125,31 +170,24 @@ class Historian:
         draw_measurement_list()
 
         # Delay to prevent accidental misclick
-        time.sleep(0.5)
-        while encoder.check_button_event() is not None:
-            time.sleep(0.01)
+        await asyncio.sleep_ms(500)
+        encoder.clear()
 
         while True:
-            move = encoder.get()
-            if move is not None:
-                if move == 1:
-                    selected = (selected + 1) % len(self.saved_measurements)
-                    draw_measurement_list()
-                elif move == -1:
-                    selected = (selected - 1) % len(self.saved_measurements)
-                    draw_measurement_list()
-
-            event = encoder.check_button_event()
-            
-            if event == "short":
-                self.view_details(oled, self.saved_measurements[selected], encoder)
+            event = await encoder.next_event()
+            if isinstance(event, int):
+                # All turns since last frame are drawn with one redraw.
+                event += encoder.get_accumulated()
+                selected = (selected + event) % len(self.saved_measurements)
+                draw_measurement_list()
+            elif event == "short":
+                await self.view_details(self.saved_measurements[selected], encoder)
                 draw_measurement_list()
             elif event == "long":
                 return  # Go back to main menu
 
-            time.sleep(0.01)
-
-    def view_details(self, oled, measurement, encoder):
+    async def view_details(self, measurement, encoder):
+        oled = self.oled
         # Determine if this is a Kubios (long) measurement
         is_kubios = "data" in measurement
 
@@ -176,6 +214,10 @@ class Historian:
                 ("RMSSD", f"{measurement['rmssd']} ms"),
                 ("SDNN", f"{measurement['sdnn']} ms")
             ]
+            # Monitoring window summaries
+            if measurement.get("analysis_type") == "window":
+                details[0] = ("Type", f"Mon {measurement['window']}s")
+                details.append(("Beats", f"{measurement['beats']}"))
 
         selected = 0
         total = len(details)
@@ -204,16 +246,12 @@ class Historian:
 
         # Wait for long press to return
         while True:
-            move = encoder.get()
-            if move == 1 and selected < total - 1:
-                selected += 1
-                draw_detail_screen()
-            elif move == -1 and selected > 0:
-                selected -= 1
-                draw_detail_screen()
-
-            event = encoder.check_button_event()
-            if event == "long":
+            event = await encoder.next_event()
+            if isinstance(event, int):
+                event += encoder.get_accumulated()
+                new_selected = min(total - 1, max(0, selected + event))
+                if new_selected != selected:
+                    selected = new_selected
+                    draw_detail_screen()
+            elif event == "long":
                 return
-
-            time.sleep(0.01)
@@ -0,0 +1,92 @@
+import array
+import math
+
+class HRVWindow:
+    """
+    HRVWindow keeps the PPIs of the last window_ms in fixed size arrays for
+    sliding window HRV. Memory doesn't grow with recording time, so it can
+    be used for monitoring that runs for hours.
+
+    add() is called by PeakDetector for every accepted beat on the sampling
+    core. summary() is called on the other core when a summary is wanted.
+    Successive differences are only taken between beats that follow each
+    other without a gap from artifacts or movement.
+
+    PARAMS:
+    window_ms(int): Window length(ms).
+    min_ppi(int): Shortest accepted PPI(ms). Sets the array size.
+    """
+    GAP_TOLERANCE = 50			# Beat times may differ this much from PPI(ms)
+
+    def __init__(self, window_ms=60000, min_ppi=300):
+        self.window_ms = window_ms
+        self.size = window_ms // min_ppi + 1
+        self.ppis = array.array("H", [0] * self.size)
+        self.times = array.array("i", [0] * self.size)	# Beat times(ms)
+        self.head = 0
+        self.count = 0
+
+    def reset(self):
+        self.head = 0
+        self.count = 0
+
+    def add(self, interval, now):
+        """Add accepted PPI(ms) of a beat at time now(ms)."""
+        head = self.head
+        self.ppis[head] = interval
+        self.times[head] = now
+        head += 1
+        if head >= self.size:
+            head = 0
+        self.head = head
+        if self.count < self.size:
+            self.count += 1
+
+    def summary(self, now):
+        """Return HRV of beats in the window ending at now(ms) as a dict like
+        hrvanalysis.calculate_hrv, or None if there are less than 2 beats."""
+        # Newest first, stop at window start.
+        head = self.head
+        count = self.count
+        start = now - self.window_ms
+        n = 0
+        total = 0
+        index = head
+        for _ in range(count):
+            index = index - 1 if index > 0 else self.size - 1
+            if self.times[index] < start:
+                break
+            total += self.ppis[index]
+            n += 1
+        if n < 2:
+            return None
+        mean_ppi = total / n
+
+        squares = 0
+        diff_squares = 0
+        diff_n = 0
+        index = head
+        previous = None
+        for _ in range(n):
+            index = index - 1 if index > 0 else self.size - 1
+            ppi = self.ppis[index]
+            squares += (ppi - mean_ppi) ** 2
+            if previous is not None:
+                # previous is the later beat. It follows this one directly
+                # if their times differ by its PPI.
+                gap = previous_time - self.times[index] - previous
+                if -HRVWindow.GAP_TOLERANCE < gap < HRVWindow.GAP_TOLERANCE:
+                    diff_squares += (previous - ppi) ** 2
+                    diff_n += 1
+            previous = ppi
+            previous_time = self.times[index]
+
+        return {
+            "analysis_type": "window",
+            "window": self.window_ms // 1000,
+            "beats": n,
+            "mean_hr": round(60000 / mean_ppi, 1),
+            "mean_ppi": round(mean_ppi, 1),
+            "rmssd": round(math.sqrt(diff_squares / diff_n), 1) if diff_n else 0,
+            "sdnn": round(math.sqrt(squares / n), 1)
+            }
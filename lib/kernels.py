@@ -0,0 +1,237 @@
+import array
+import sys
+
+"""kernels library has the per-sample integer kernels of the heart rate
+algorithm. Every kernel has a plain Python version, which is the reference and
+runs on CPython too, and a viper version for MicroPython. use_viper() selects
+which ones the module level names point to, so callers must call them as
+kernels.name(...) to follow the selection.
+
+Values are integers. Normalized samples are Q15: 0-32767 is 0.0-1.0.
+"""
+
+Q15_ONE = 32767
+
+# The viper decorator is handled by the MicroPython compiler, the micropython
+# module has no attribute for it. Viper code is compiled on MicroPython only.
+VIPER_AVAILABLE = sys.implementation.name == "micropython"
+if VIPER_AVAILABLE:
+    import micropython
+
+
+# --- Reference kernels -------------------------------------------------------
+
+def ravg_state(size):
+    """Return (buffer, state) for ravg_update. State is index, sum, count,
+    size."""
+    return array.array("i", [0] * size), array.array("i", [0, 0, 0, size])
+
+
+def py_ravg_update(buf, state, value):
+    """Push value to rolling average buffer and return the new average."""
+    index = state[0]
+    total = state[1] - buf[index] + value
+    buf[index] = value
+    state[1] = total
+    index += 1
+    if index >= state[3]:
+        index = 0
+    state[0] = index
+    count = state[2]
+    if count < state[3]:
+        count += 1
+        state[2] = count
+    return total // count
+
+
+def py_ring_put(buf, head, size, value):
+    """Write value at head of ring buffer. Returns the new head."""
+    buf[head] = value
+    head += 1
+    if head >= size:
+        head = 0
+    return head
+
+
+def py_normalize_q15(value, bounds):
+    """Min-max normalize value to Q15 with bounds array [min, max]. Values
+    out of bounds are clamped and move the bound."""
+    low = bounds[0]
+    high = bounds[1]
+    if value >= high:
+        bounds[1] = value
+        return Q15_ONE
+    if value <= low:
+        bounds[0] = value
+        return 0
+    return (value - low) * Q15_ONE // (high - low)
+
+
+def py_dc_block(state, value):
+    """One pole high-pass. State is a(Q15), x1, y1, err. The remainder of
+    the feedback product is carried to the next sample so truncation doesn't
+    bias the output."""
+    acc = state[0] * state[2] + state[3]
+    y = value - state[1] + (acc >> 15)
+    state[3] = acc - ((acc >> 15) << 15)
+    state[1] = value
+    state[2] = y
+    return y
+
+
+def py_biquad(state, value):
+    """Direct form I biquad. State is b0, b1, b2, a1, a2 (Q14), x1, x2, y1,
+    y2, err. Remainder is carried like in dc_block."""
+    acc = (state[0] * value + state[1] * state[5] + state[2] * state[6]
+           - state[3] * state[7] - state[4] * state[8] + state[9])
+    y = acc >> 14
+    state[9] = acc - (y << 14)
+    state[6] = state[5]
+    state[5] = value
+    state[8] = state[7]
+    state[7] = y
+    return y
+
+
+# --- Viper kernels -----------------------------------------------------------
+
+if VIPER_AVAILABLE:
+    @micropython.viper
+    def viper_ravg_update(buf: ptr32, state: ptr32, value: int) -> int:
+        index = state[0]
+        total = state[1] - buf[index] + value
+        buf[index] = value
+        state[1] = total
+        index += 1
+        if index >= state[3]:
+            index = 0
+        state[0] = index
+        count = state[2]
+        if count < state[3]:
+            count += 1
+            state[2] = count
+        return total // count
+
+    @micropython.viper
+    def viper_ring_put(buf: ptr32, head: int, size: int, value: int) -> int:
+        buf[head] = value
+        head += 1
+        if head >= size:
+            head = 0
+        return head
+
+    @micropython.viper
+    def viper_normalize_q15(value: int, bounds: ptr32) -> int:
+        low = bounds[0]
+        high = bounds[1]
+        if value >= high:
+            bounds[1] = value
+            return 32767
+        if value <= low:
+            bounds[0] = value
+            return 0
+        return (value - low) * 32767 // (high - low)
+
+    @micropython.viper
+    def viper_dc_block(state: ptr32, value: int) -> int:
+        acc = state[0] * state[2] + state[3]
+        y = value - state[1] + (acc >> 15)
+        state[3] = acc - ((acc >> 15) << 15)
+        state[1] = value
+        state[2] = y
+        return y
+
+    @micropython.viper
+    def viper_biquad(state: ptr32, value: int) -> int:
+        acc = (state[0] * value + state[1] * state[5] + state[2] * state[6]
+               - state[3] * state[7] - state[4] * state[8] + state[9])
+        y = acc >> 14
+        state[9] = acc - (y << 14)
+        state[6] = state[5]
+        state[5] = value
+        state[8] = state[7]
+        state[7] = y
+        return y
+
+
+# --- Selection ---------------------------------------------------------------
+
+ravg_update = py_ravg_update
+ring_put = py_ring_put
+normalize_q15 = py_normalize_q15
+dc_block = py_dc_block
+biquad = py_biquad
+using_viper = False
+
+
+def use_viper(enable=True):
+    """Select viper or reference kernels. Returns True if viper is in use."""
+    global ravg_update, ring_put, normalize_q15, dc_block, biquad, using_viper
+    using_viper = enable and VIPER_AVAILABLE
+    if using_viper:
+        ravg_update = viper_ravg_update
+        ring_put = viper_ring_put
+        normalize_q15 = viper_normalize_q15
+        dc_block = viper_dc_block
+        biquad = viper_biquad
+    else:
+        ravg_update = py_ravg_update
+        ring_put = py_ring_put
+        normalize_q15 = py_normalize_q15
+        dc_block = py_dc_block
+        biquad = py_biquad
+    return using_viper
+
+
+use_viper(VIPER_AVAILABLE)
+
+
+# --- Equivalence check -------------------------------------------------------
+
+def _run(samples, ravg, ring, normalize, dc, bq):
+    # Run kernels over samples like the heart rate algorithm does. Returns
+    # list of rolling averages of the normalized, filtered samples.
+    avg_buf, avg_state = ravg_state(10)
+    ring_buf = array.array("i", [0] * 250)
+    head = 0
+    # 0.5 Hz high-pass and 5 Hz low-pass at 250 Hz.
+    dc_state = array.array("i", [32359, samples[0] >> 4, 0, 0])
+    bq_state = array.array("i", [59, 119, 59, -29863, 13716, 0, 0, 0, 0, 0])
+    bounds = array.array("i", [-100, 100])
+    out = []
+    for sample in samples:
+        value = bq(bq_state, dc(dc_state, sample >> 4))
+        head = ring(ring_buf, head, 250, value)
+        out.append(ravg(avg_buf, avg_state, normalize(value, bounds)))
+    return out
+
+
+def check(samples):
+    """Run reference and viper kernels over the same samples and compare.
+    Returns number of differing results, or None if viper is not
+    available."""
+    reference = _run(samples, py_ravg_update, py_ring_put, py_normalize_q15,
+                     py_dc_block, py_biquad)
+    if not VIPER_AVAILABLE:
+        print("Viper not available. Reference kernels only.")
+        return None
+    fast = _run(samples, viper_ravg_update, viper_ring_put, viper_normalize_q15,
+                viper_dc_block, viper_biquad)
+    errors = sum(1 for a, b in zip(reference, fast) if a != b)
+    print(f"{len(samples)} samples, {errors} differences")
+    return errors
+
+
+if __name__ == "__main__":
+    # Recording file has one raw sample per line. Without one, a synthetic
+    # recording is used, so the check can be run on the Pico with
+    # mpremote run lib/kernels.py.
+    filename = sys.argv[1] if len(sys.argv) > 1 else "capture_250Hz_01.txt"
+    try:
+        with open(filename) as f:
+            recording = [int(line) for line in f if line.strip()]
+    except OSError:
+        from ppgsynth import PPGSynth
+        print(f"{filename} not found. Using a synthetic recording.")
+        recording = PPGSynth(motion_rate=6).samples(2500)
+    check(recording)
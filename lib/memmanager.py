@@ -0,0 +1,86 @@
+import gc
+
+class MemoryManager:
+    """
+    MemoryManager keeps garbage collection out of the measurement. Before a
+    recording the heap is collected and automatic collection is pushed back,
+    then collections are run between display frames when enough has been
+    allocated.
+
+    MicroPython's heap can't be compacted, so the best that can be done
+    before a recording is to drop big objects and collect.
+    """
+    IDLE_COLLECT_BYTES = 4096		# Collect in idle time after this much allocated
+    SESSION_THRESHOLD_SHARE = 2		# Automatic collection after 1/2 of free heap
+
+    def __init__(self):
+        self.old_threshold = None
+        self.last_alloc = gc.mem_alloc()
+        self.collections = 0		# Idle collections during session
+        self.min_free = None		# Lowest free heap seen during session
+        self.last_session = None	# Heap stats at the end of last session
+        self.release_callbacks = []
+
+    def register_cache(self, release):
+        """Register function that frees a cache that can be rebuilt later.
+        Called before every recording session."""
+        self.release_callbacks.append(release)
+
+    def start_session(self):
+        """Free caches, collect and set GC threshold for a recording
+        session."""
+        for release in self.release_callbacks:
+            release()
+        gc.collect()
+        self.old_threshold = gc.threshold()
+        # Automatic collection stays only as a safety net in case idle
+        # collections can't keep up.
+        gc.threshold(gc.mem_free() // MemoryManager.SESSION_THRESHOLD_SHARE)
+        self.last_alloc = gc.mem_alloc()
+        self.collections = 0
+        self.min_free = gc.mem_free()
+
+    def end_session(self):
+        """Restore GC threshold. Returns heap stats of the session."""
+        if self.old_threshold is not None:
+            gc.threshold(self.old_threshold)
+            self.old_threshold = None
+        self.last_session = self.stats()
+        self.last_session["min_free"] = self.min_free
+        self.last_session["collections"] = self.collections
+        return self.last_session
+
+    def idle_collect(self):
+        """Call when there is idle time, for example right after a frame is
+        shown. Collects if enough has been allocated since last collection."""
+        free = gc.mem_free()
+        if self.min_free is not None and free < self.min_free:
+            self.min_free = free
+        if gc.mem_alloc() - self.last_alloc > MemoryManager.IDLE_COLLECT_BYTES:
+            gc.collect()
+            self.last_alloc = gc.mem_alloc()
+            self.collections += 1
+
+    def largest_block(self):
+        """Return size of the largest allocatable block(bytes). Found by
+        trying allocations, so don't call this in time critical code."""
+        low = 0
+        high = gc.mem_free()
+        while low < high:
+            size = (low + high + 1) // 2
+            try:
+                block = bytearray(size)
+                del block
+                low = size
+            except MemoryError:
+                high = size - 1
+        return low
+
+    def stats(self):
+        """Return heap statistics dict."""
+        gc.collect()
+        return {
+            "free": gc.mem_free(),
+            "alloc": gc.mem_alloc(),
+            "largest": self.largest_block()
+            }
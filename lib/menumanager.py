@@ -1,54 +1,67 @@
-import time
-from machine import Pin
+import asyncio
 import menuicons as icons
 import framebuf
 
 class MenuManager:
-    BUTTON_PIN = 12
     # Class for handling the Main Menu system and simple screen messages
+    ROW_HEIGHT = 16
+    ROW_BYTES = 128 * 16 // 8
+    VISIBLE_ROWS = 64 // 16
+    DEBUG_SCREEN = -1  # Returned by run_main_menu on long press
+    
     def __init__(self, oled, encoder):
-        # Initialize MenuManager with OLED, encoder, and button pin
+        # Initialize MenuManager with Display and encoder
         self.oled = oled
         self.encoder = encoder
-        self.button = Pin(MenuManager.BUTTON_PIN, Pin.IN, Pin.PULL_UP)
-        self.last_button = 1
+        # Icon list must match menu items
+        self.icon_map = [
+            icons.heart_icon,
+            icons.chart_icon,
+            icons.kubios_icon,
+            icons.history_icon,
+            icons.monitor_icon
+        ]
+        # Pre-rendered menu rows by (item index, selected)
+        self.row_cache = {}
+        self.row_cache_items = None
+        # Row keys currently on display. None forces a full redraw.
+        self.shown_rows = None
 
-    def run_main_menu(self):
+    async def run_main_menu(self):
         print("Main menu opened")
         # Draw and run the main menu. Return selected choice
         menu_items = [
             "Measure HR",
             "HRV Analysis",
             "Kubios",
-            "History"
+            "History",
+            "Monitor"
         ]
 
         selected = 0  # Start with the first menu item
+        self.shown_rows = None  # Other screens have drawn over the menu
         self._draw_menu(menu_items, selected)  # Draw the initial menu
 
         # Delay after entering the Main Menu
-        time.sleep(0.5)
-        while self.button.value() == 0:
-            time.sleep(0.01)
+        await asyncio.sleep_ms(500)
+        self.encoder.clear()
 
         while True:
-            move = self.encoder.get()
-            if move is not None:
-                if move == 1:
+            event = await self.encoder.next_event()
+            if isinstance(event, int):
+                # Short list. Move one item per redraw whatever the speed.
+                event += self.encoder.get_accumulated()
+                if event > 0:
                     selected = (selected + 1) % len(menu_items)  # Scroll down
-                    self._draw_menu(menu_items, selected)
-                elif move == -1:
+                elif event < 0:
                     selected = (selected - 1) % len(menu_items)  # Scroll up
-                    self._draw_menu(menu_items, selected)
-
-            if self.button.value() == 0 and self.last_button == 1:
-                time.sleep(0.05)  # Fast debounce
+                self._draw_menu(menu_items, selected)
+            elif event == "short":
                 return selected  # Return selected menu index
+            elif event == "long":
+                return MenuManager.DEBUG_SCREEN
 
-            self.last_button = self.button.value()
-            time.sleep(0.01)  # Small loop delay
-
-    def show_collecting_screen(self):
+    async def show_collecting_screen(self):
         # Show a 'Collecting HR...' screen with a loading animation
         self.oled.fill(0)
         self.oled.text("Collecting HR...", 2, 10)
@@ -59,7 +72,7 @@ class MenuManager:
         for progress in range(1, 108, 5):
             self.oled.fill_rect(11, 41, progress, 8, 1)
             self.oled.show()
-            time.sleep(0.05)
+            await asyncio.sleep_ms(50)
 
     def show_calculating_screen(self):
         # Show a splash screen saying 'Calculating HRV...'
@@ -67,7 +80,7 @@ class MenuManager:
         self.oled.text("Calculating HRV...", 10, 25)
         self.oled.show()
 
-    def show_analysis_screen(self, results):
+    async def show_analysis_screen(self, results):
         # Show HRV analysis results on the screen
         self.oled.fill(0)
         self.oled.text(f"HR: {results['mean_hr']} bpm", 2, 0)
@@ -75,38 +88,77 @@ class MenuManager:
         self.oled.text(f"RMSSD: {results['rmssd']} ms", 2, 24)
         self.oled.text(f"SDNN: {results['sdnn']} ms", 2, 36)
         self.oled.show()
-        time.sleep(5)
+        await asyncio.sleep(5)
 
-    def show_simple_message(self, message):
+    async def show_simple_message(self, message):
         # Show a simple short message
         self.oled.fill(0)
         self.oled.text(message, 2, 25)
         self.oled.show()
-        time.sleep(2)
+        await asyncio.sleep(2)
+
+    def _render_row(self, index, item, inverted):
+        # Render one menu row to its own framebuffer. Same MONO_VLSB format
+        # as the display so that blitting is a plain copy.
+        buffer = bytearray(MenuManager.ROW_BYTES)
+        row = framebuf.FrameBuffer(buffer, 128, MenuManager.ROW_HEIGHT, framebuf.MONO_VLSB)
+
+        # Only blit icon if it exists
+        if index < len(self.icon_map):
+            row.blit(self.icon_map[index], 0, 0)
+
+        # Draw selection highlight and text
+        if inverted:
+            row.fill_rect(18, 0, 110, 16, 1)
+            row.text(item, 20, 4, 0)
+        else:
+            row.text(item, 20, 4, 1)
+        return row
 
     def _draw_menu(self, items, selected):
-        self.oled.fill(0)
-
-    # Icon list must match menu items
-        icon_map = [
-            icons.heart_icon,
-            icons.chart_icon,
-            icons.kubios_icon,
-            icons.history_icon
-        ]
-
-        for i, item in enumerate(items):
-            y = i * 16
-
-            # Only blit icon if it exists
-            if i < len(icon_map):
-                self.oled.blit(icon_map[i], 0, y)
-
-            # Draw selection highlight and text
-            if i == selected:
-                self.oled.fill_rect(18, y, 110, 16, 1)
-                self.oled.text(item, 20, y + 4, 0)
+        # Rows are rendered once per item in normal and inverted form. A frame
+        # is composed by blitting cached rows and only rows that changed since
+        # the last frame are sent to the display.
+        if self.row_cache_items != items:
+            self.row_cache = {}
+            self.row_cache_items = items
+            self.shown_rows = None
+
+        # Scroll so that the selected item is visible.
+        first = max(0, selected - MenuManager.VISIBLE_ROWS + 1)
+        rows = []
+        for r in range(MenuManager.VISIBLE_ROWS):
+            i = first + r
+            if i < len(items):
+                rows.append((i, i == selected))
             else:
-                self.oled.text(item, 20, y + 4, 1)
-
-        self.oled.show()
\ No newline at end of file
+                rows.append(None)
+
+        full_redraw = self.shown_rows is None
+        if full_redraw:
+            self.oled.fill(0)
+            self.shown_rows = [None] * MenuManager.VISIBLE_ROWS
+
+        changed = []
+        for r, key in enumerate(rows):
+            if not full_redraw and key == self.shown_rows[r]:
+                continue
+            y = r * MenuManager.ROW_HEIGHT
+            if key is None:
+                self.oled.fill_rect(0, y, 128, MenuManager.ROW_HEIGHT, 0)
+            else:
+                row = self.row_cache.get(key)
+                if row is None:
+                    row = self._render_row(key[0], items[key[0]], key[1])
+                    self.row_cache[key] = row
+                self.oled.blit(row, 0, y)
+            self.shown_rows[r] = key
+            changed.append(r)
+
+        if full_redraw:
+            self.oled.show()
+        else:
+            # One row is two 8 pixel pages of the display.
+            for r in changed:
+                page = r * MenuManager.ROW_HEIGHT // 8
+                self.oled.show_pages(page, page + 1)
@@ -1,19 +1,98 @@
 import network
 import time
-import mip
-import ntptime
+import json
+from bootprofiler import LazyModule
+from outbox import Outbox
 from umqtt.simple import MQTTClient
 
+# Rarely needed modules are imported on first use to keep boot fast.
+mip = LazyModule("mip")
+ntptime = LazyModule("ntptime")
+payloads = LazyModule("payload")	# Only needed for Kubios requests
+
 class Networker:
     # Handles WiFi and MQTT connection
+    REQUEST_TIMEOUT = 20000		# Time to wait for a request response(ms)
+    REQUEST_RETRIES = 2			# How many times a request is resent
+    QUEUE_TIMEOUT = 120000		# Time a request may wait for connection(ms)
+    BINARY_PAYLOAD = False		# Send requests delta encoded. Needs proxy support
+    MQTT_PORT = 21883
+    KEEPALIVE = 60				# MQTT keepalive(s)
+    PING_INTERVAL = 30000		# Ping broker if nothing sent in this time(ms)
+    BACKOFF_MIN = 2000			# First reconnect delay(ms)
+    BACKOFF_MAX = 60000			# Longest reconnect delay(ms)
+    CONNECT_TIMEOUT = 2			# Broker connect socket timeout(s)
+
+    WIFI_TIMEOUT = 10000		# WiFi is reported failed after this(ms)
+
+    # MQTT connection states
+    MQTT_DISCONNECTED = 0
+    MQTT_CONNECTED = 1
+
+    # Network bring-up stages
+    BOOT_IDLE = 0				# start() not called
+    BOOT_WIFI = 1				# Waiting for WiFi
+    BOOT_TIME = 2				# Syncing time with NTP
+    BOOT_DONE = 3				# MQTT managed by maintain_connection
+
     def __init__(self, ssid, password, broker_ip):
         self.ssid = ssid
         self.password = password
         self.broker_ip = broker_ip
         self.client = None
+        self.wlan = None
+        self.message_callback = None	# Callback for uncorrelated messages
+        self.pending = {}				# In-flight requests by id
+        self.queued = []				# Requests waiting for connection
+        self.last_request_id = 0
+        # MQTT connection manager
+        self.mqtt_state = Networker.MQTT_DISCONNECTED
+        self.client_id = None
+        self.sub_topic = None
+        self.backoff = Networker.BACKOFF_MIN
+        self.reconnect_at = time.ticks_ms()
+        self.last_activity = time.ticks_ms()
+        self.outbox = Outbox()			# Messages waiting for connection
+        self.busy = None				# Function, True while reconnecting must wait
+        self.boot_stage = Networker.BOOT_IDLE
+        self.boot_start = time.ticks_ms()
+
+    def start(self, client_id, sub_topic=None, callback=None):
+        # Start network bring-up without blocking. Each poll() call moves it
+        # forward: WiFi > NTP time sync > MQTT.
+        self.client_id = client_id
+        self.sub_topic = sub_topic
+        self.message_callback = callback
+        self.wlan = network.WLAN(network.STA_IF)
+        self.wlan.active(True)
+        if not self.wlan.isconnected():
+            print("Connecting to WiFi...")
+            self.wlan.connect(self.ssid, self.password)
+        self.boot_stage = Networker.BOOT_WIFI
+        self.boot_start = time.ticks_ms()
+
+    def _boot_step(self):
+        # One non-blocking step of network bring-up.
+        if self.boot_stage == Networker.BOOT_WIFI:
+            if self.wifi_connected():
+                print("Connected to WiFi. IP:", self.wlan.ifconfig()[0])
+                self.boot_stage = Networker.BOOT_TIME
+        elif self.boot_stage == Networker.BOOT_TIME:
+            self.sync_time()
+            self.boot_stage = Networker.BOOT_DONE
+            self.reconnect_at = time.ticks_ms()
+
+    def wifi_failed(self):
+        # True if WiFi didn't connect in WIFI_TIMEOUT after start().
+        return (self.boot_stage == Networker.BOOT_WIFI and
+                time.ticks_diff(time.ticks_ms(), self.boot_start) > Networker.WIFI_TIMEOUT)
+
+    def ready(self):
+        # True when network is up and MQTT is connected.
+        return self.boot_stage == Networker.BOOT_DONE and self.mqtt_connected()
 
     def connect_wifi(self):
-        # Connect to WiFi network
+        # Connect to WiFi network. Blocks up to 5 seconds.
         self.wlan = network.WLAN(network.STA_IF)
         self.wlan.active(True)
         if not self.wlan.isconnected():
@@ -31,6 +110,7 @@ class Networker:
         
         if self.wlan.isconnected():
             print("Connected to WiFi. IP:", self.wlan.ifconfig()[0])
+            self.boot_stage = Networker.BOOT_DONE
             return True
         else:
             raise RuntimeError("Failed to connect to WiFi")
@@ -60,38 +140,284 @@ class Networker:
             print(f"Could not install MQTT: {e}")
 
     def connect_mqtt(self, client_id, sub_topic=None, callback=None):
-        # Connect to MQTT broker and subscribe to a topic
-        self.client = MQTTClient(client_id, self.broker_ip, port=21883)
+        # Connect to MQTT broker and subscribe to a topic. Settings are stored
+        # so that poll() can reconnect if the connection is lost. Returns True
+        # if connected.
+        self.client_id = client_id
+        self.sub_topic = sub_topic
+        # Responses to tracked requests are handled by the networker. Other
+        # messages are passed on to the callback.
+        self.message_callback = callback
+        if not self.wifi_connected():
+            print("WARNING: No WiFi. MQTT connects when WiFi is up.")
+            return False
+        return self._connect()
 
-        if callback:
-            self.client.set_callback(callback)
+    def _connect(self):
+        self.client = MQTTClient(self.client_id, self.broker_ip,
+                                 port=Networker.MQTT_PORT,
+                                 keepalive=Networker.KEEPALIVE)
+        self.client.set_callback(self._on_message)
 
         print("Connecting to MQTT Broker...")
-        self.client.connect()
+        try:
+            # Connect runs in the network task. Short timeout so that an
+            # unreachable broker doesn't freeze the UI.
+            try:
+                self.client.connect(timeout=Networker.CONNECT_TIMEOUT)
+            except TypeError:
+                # umqtt.simple before 1.4 has no connect timeout.
+                self.client.connect()
+            if self.sub_topic:
+                self.client.subscribe(self.sub_topic)
+                print(f"Subscribed to topic: {self.sub_topic}")
+        except OSError as e:
+            print(f"WARNING: MQTT connection failed: {e}")
+            self._connection_lost()
+            return False
         print("Connected to MQTT Broker.")
+        self.mqtt_state = Networker.MQTT_CONNECTED
+        self.backoff = Networker.BACKOFF_MIN
+        self.last_activity = time.ticks_ms()
+        return True
 
-        if sub_topic:
-            self.client.subscribe(sub_topic)
-            print(f"Subscribed to topic: {sub_topic}")
+    def _connection_lost(self):
+        # Mark MQTT disconnected and schedule reconnect with exponential
+        # backoff. Socket is closed after failed connects too, so that
+        # retries don't run out of sockets.
+        if self.mqtt_state == Networker.MQTT_CONNECTED:
+            print("WARNING: MQTT connection lost")
+        if self.client and self.client.sock:
+            try:
+                self.client.sock.close()
+            except Exception:
+                pass
+            self.client.sock = None
+        self.mqtt_state = Networker.MQTT_DISCONNECTED
+        self.reconnect_at = time.ticks_add(time.ticks_ms(), self.backoff)
+        self.backoff = min(self.backoff * 2, Networker.BACKOFF_MAX)
+
+    def mqtt_connected(self):
+        return self.mqtt_state == Networker.MQTT_CONNECTED
+
+    def maintain_connection(self):
+        # Reconnect when it's time and WiFi is up. Ping broker when idle so
+        # that keepalive doesn't expire.
+        if self.boot_stage != Networker.BOOT_DONE:
+            self._boot_step()
+            return
+        if not self.client_id:
+            return
+        now = time.ticks_ms()
+        if not self.mqtt_connected():
+            # Connect blocks up to CONNECT_TIMEOUT, so it waits until the
+            # device isn't busy.
+            if self.busy and self.busy():
+                return
+            if self.wifi_connected() and time.ticks_diff(now, self.reconnect_at) >= 0:
+                self._connect()
+        elif time.ticks_diff(now, self.last_activity) > Networker.PING_INTERVAL:
+            try:
+                self.client.ping()
+                self.last_activity = now
+            except OSError:
+                self._connection_lost()
 
     def publish(self, topic, payload):
-        # Publish a message to a topic
-        if self.client:
-            print(f"Publishing to {topic}...")
+        # Publish a message to a topic. If not connected or sending fails the
+        # message is stored to outbox and sent after reconnecting. While the
+        # outbox has messages, new ones go after them so that order is kept.
+        if self.outbox.count:
+            self.outbox.put(topic, payload)
+            if self.mqtt_connected():
+                self.outbox.drain(self._publish_now)
+            return
+        if not self._publish_now(topic, payload):
+            print(f"Message to {topic} stored to outbox")
+            self.outbox.put(topic, payload)
+
+    def _publish_now(self, topic, payload):
+        # Returns True if message was sent.
+        if not self.mqtt_connected():
+            return False
+        print(f"Publishing to {topic}...")
+        try:
             self.client.publish(topic, payload)
+        except OSError:
+            self._connection_lost()
+            return False
+        self.last_activity = time.ticks_ms()
+        return True
+
+    def publish_stream(self, topic, obj, binary=False):
+        # Publish dict as JSON or binary payload without building the whole
+        # message in RAM. Length is counted first, then the payload is encoded
+        # straight to the socket in chunks.
+        if not self.mqtt_connected():
+            return False
+        if binary:
+            encode, length = payloads.write_binary, payloads.binary_length(obj)
+        else:
+            encode, length = payloads.write_json, payloads.json_length(obj)
+        print(f"Publishing {length} bytes to {topic}...")
+
+        # MQTT PUBLISH header, QoS 0. Remaining length is a varint.
+        pkt = bytearray(b"\x30\0\0\0\0")
+        size = 2 + len(topic) + length
+        i = 1
+        while size > 0x7F:
+            pkt[i] = (size & 0x7F) | 0x80
+            size >>= 7
+            i += 1
+        pkt[i] = size
+        sock = self.client.sock
+        try:
+            sock.write(pkt, i + 1)
+            self.client._send_str(topic)
+
+            writer = payloads.ChunkWriter(sock.write)
+            encode(obj, writer.write)
+            writer.flush()
+        except OSError:
+            self._connection_lost()
+            return False
+        self.last_activity = time.ticks_ms()
+        return True
 
     def check_messages(self):
         # Check for incoming MQTT messages
-        if self.client:
-            self.client.check_msg()
+        if self.mqtt_connected():
+            try:
+                self.client.check_msg()
+            except OSError:
+                self._connection_lost()
+
+    def new_request_id(self):
+        # Request id is current time. Bumped if two requests are made during
+        # the same second so that the responses can still be told apart.
+        request_id = max(time.time(), self.last_request_id + 1)
+        self.last_request_id = request_id
+        return request_id
+
+    def request(self, topic, payload, callback, timeout=None, retries=None):
+        # Publish a request without waiting for the response. Response is
+        # matched by payload id and passed to callback when poll() receives it.
+        # Callback gets None if the request times out. Requests made while
+        # offline are queued and sent once connection is back, if that
+        # happens within QUEUE_TIMEOUT.
+        req = {
+            "topic": topic,
+            "payload": payload,
+            "callback": callback,
+            "timeout": timeout or Networker.REQUEST_TIMEOUT,
+            "retries": Networker.REQUEST_RETRIES if retries is None else retries,
+            "deadline": None,
+            "queued_until": None
+            }
+        if self.mqtt_connected():
+            self._send_request(req)
+        else:
+            print("WARNING: Offline. Request queued.")
+            self._queue(req)
+        return payload["id"]
+
+    def is_pending(self, request_id):
+        # Returns True while request is waiting to be sent or for a response.
+        if request_id in self.pending:
+            return True
+        for req in self.queued:
+            if req["payload"]["id"] == request_id:
+                return True
+        return False
 
-    def wait_for_message(self):
-        # Wait for a single incoming MQTT message
-        if self.client:
-            self.client.wait_msg()
+    def request_progress(self, request_id):
+        # Returns 0-1 of the time used from current attempt's timeout, or
+        # from QUEUE_TIMEOUT if the request is queued.
+        req = self.pending.get(request_id)
+        if req:
+            deadline, timeout = req["deadline"], req["timeout"]
+        else:
+            for req in self.queued:
+                if req["payload"]["id"] == request_id:
+                    break
+            else:
+                return 0
+            deadline, timeout = req["queued_until"], Networker.QUEUE_TIMEOUT
+        left = time.ticks_diff(deadline, time.ticks_ms())
+        return min(1, max(0, 1 - left / timeout))
+
+    def poll(self):
+        # Non-blocking network upkeep. Call often from the main loop. Keeps
+        # MQTT connected, sends queued messages, checks for incoming messages
+        # and handles request timeouts.
+        self.maintain_connection()
+        if self.mqtt_connected():
+            self.outbox.drain(self._publish_now)
+        if self.queued and self.mqtt_connected():
+            queued = self.queued
+            self.queued = []
+            for req in queued:
+                self._send_request(req)
+
+        self.check_messages()
+
+        now = time.ticks_ms()
+        for request_id, req in list(self.pending.items()):
+            if time.ticks_diff(now, req["deadline"]) < 0:
+                continue
+            if req["retries"] > 0:
+                req["retries"] -= 1
+                print(f"WARNING: Request {request_id} timed out. Retrying...")
+                self._send_request(req)
+            else:
+                print(f"ERROR: Request {request_id} timed out")
+                del self.pending[request_id]
+                req["callback"](None)
+        for req in self.queued:
+            if time.ticks_diff(now, req["queued_until"]) >= 0:
+                print(f"ERROR: Request {req['payload']['id']} timed out in queue")
+                self.queued.remove(req)
+                req["callback"](None)
+                # List changed. Rest are checked on next poll.
+                break
+
+    def _send_request(self, req):
+        # Requests that can't be sent go back to the queue.
+        if not self.publish_stream(req["topic"], req["payload"],
+                                   binary=Networker.BINARY_PAYLOAD):
+            self.pending.pop(req["payload"]["id"], None)
+            self._queue(req)
+            return
+        req["deadline"] = time.ticks_add(time.ticks_ms(), req["timeout"])
+        req["queued_until"] = None
+        self.pending[req["payload"]["id"]] = req
+
+    def _queue(self, req):
+        # Queue request until connection is back or QUEUE_TIMEOUT passes.
+        # Deadline is kept if the request goes back to the queue without
+        # being sent, so that a flapping connection can't hold it forever.
+        if req["queued_until"] is None:
+            req["queued_until"] = time.ticks_add(time.ticks_ms(), Networker.QUEUE_TIMEOUT)
+        self.queued.append(req)
+
+    def _on_message(self, topic, msg):
+        # MQTT callback. Routes responses to the request they belong to.
+        try:
+            message = json.loads(msg)
+        except ValueError:
+            print(f"WARNING: Invalid message on {topic}")
+            return
+        req = None
+        if isinstance(message, dict):
+            req = self.pending.pop(message.get("id"), None)
+        if req:
+            req["callback"](message)
+        elif self.message_callback:
+            self.message_callback(topic, message)
 
     def disconnect(self):
         # Disconnect from MQTT broker
-        if self.client:
+        if self.mqtt_connected():
             self.client.disconnect()
+            self.mqtt_state = Networker.MQTT_DISCONNECTED
             print("Disconnected from MQTT.")
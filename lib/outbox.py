@@ -0,0 +1,62 @@
+import json
+
+class Outbox:
+    # Bounded on-flash queue for MQTT messages that could not be sent.
+    # Messages are stored one JSON object per line, oldest first.
+    def __init__(self, filename="/outbox.txt", max_entries=50):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.count = len(self._load())
+
+    def _load(self):
+        # Read all queued messages from file
+        messages = []
+        try:
+            with open(self.filename, "r") as f:
+                for line in f:
+                    if line.strip():
+                        messages.append(json.loads(line))
+        except Exception:
+            pass
+        return messages
+
+    def _save(self, messages):
+        # Rewrite file with given messages
+        try:
+            with open(self.filename, "w") as f:
+                for message in messages:
+                    json.dump(message, f)
+                    f.write("\n")
+        except Exception as e:
+            print("Error writing outbox:", e)
+        self.count = len(messages)
+
+    def put(self, topic, payload):
+        # Append message. Oldest messages are dropped when the queue is full.
+        if self.count >= self.max_entries:
+            messages = self._load()
+            messages.append({"topic": topic, "payload": payload})
+            print("WARNING: Outbox full. Oldest message dropped.")
+            self._save(messages[-self.max_entries:])
+            return
+        try:
+            with open(self.filename, "a") as f:
+                json.dump({"topic": topic, "payload": payload}, f)
+                f.write("\n")
+            self.count += 1
+        except Exception as e:
+            print("Error appending to outbox:", e)
+
+    def drain(self, send):
+        # Send queued messages in order with send(topic, payload). Stops at
+        # the first message send fails to deliver and keeps the rest.
+        if not self.count:
+            return
+        messages = self._load()
+        sent = 0
+        for message in messages:
+            if not send(message["topic"], message["payload"]):
+                break
+            sent += 1
+        print(f"Outbox: {sent}/{len(messages)} messages sent")
+        self._save(messages[sent:])
@@ -0,0 +1,188 @@
+import json
+
+"""payload library encodes MQTT payloads in small chunks so that long PPI
+lists can be sent without building the whole message string in RAM.
+
+Two formats are supported. JSON is what the Kubios proxy understands. Binary
+format stores the PPI list as delta encoded varints:
+
+    b"PB" version(1 byte) header_length(varint) header(JSON without "data")
+    ppi_count(varint) first_ppi(varint) deltas(zigzag varint)...
+"""
+
+BINARY_MAGIC = b"PB"
+BINARY_VERSION = 1
+
+
+class ChunkWriter:
+    """
+    ChunkWriter collects small writes into a fixed size buffer and passes
+    full chunks to the output function.
+
+    PARAMS:
+    output(function): Called with each chunk, for example socket.write.
+    size(int): Chunk size in bytes.
+    """
+    def __init__(self, output, size=256):
+        self.output = output
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.size = size
+        self.n = 0					# Bytes in buffer
+        self.total = 0				# Total bytes written
+
+    def write(self, data):
+        """Write str or bytes like object."""
+        if isinstance(data, str):
+            data = data.encode()
+        length = len(data)
+        self.total += length
+        if self.n + length > self.size:
+            self.flush()
+        # Too big for the buffer. Pass straight through.
+        if length > self.size:
+            self.output(data)
+            return
+        self.buffer[self.n:self.n + length] = data
+        self.n += length
+
+    def flush(self):
+        """Pass buffered data to output."""
+        if self.n:
+            self.output(self.view[:self.n])
+            self.n = 0
+
+
+class _Counter:
+    # Stand-in writer that only counts the bytes.
+    def __init__(self):
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+
+
+def write_json(obj, write):
+    """Encode obj as JSON piece by piece to write function."""
+    if type(obj) is int:
+        write(str(obj))
+    elif isinstance(obj, dict):
+        write("{")
+        first = True
+        for key, value in obj.items():
+            if not first:
+                write(", ")
+            first = False
+            write(json.dumps(str(key)))
+            write(": ")
+            write_json(value, write)
+        write("}")
+    elif isinstance(obj, (list, tuple)):
+        write("[")
+        for i, value in enumerate(obj):
+            if i:
+                write(", ")
+            write_json(value, write)
+        write("]")
+    else:
+        write(json.dumps(obj))
+
+
+def json_length(obj):
+    """Return byte length of obj encoded by write_json."""
+    counter = _Counter()
+    write_json(obj, counter.write)
+    return counter.total
+
+
+# --- Binary format -----------------------------------------------------------
+
+def _varint(value, buf):
+    # Write unsigned varint to buf. Returns length.
+    i = 0
+    while value > 0x7F:
+        buf[i] = (value & 0x7F) | 0x80
+        value >>= 7
+        i += 1
+    buf[i] = value
+    return i + 1
+
+
+def _zigzag(value):
+    # Map signed to unsigned so that small negative deltas stay small.
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+
+def _unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+def _binary_header(obj):
+    header = {}
+    for key, value in obj.items():
+        if key != "data":
+            header[key] = value
+    return json.dumps(header)
+
+
+def write_binary(obj, write):
+    """Encode payload dict obj to write function in binary format. obj["data"]
+    must be a list of PPI values in milliseconds."""
+    buf = bytearray(5)
+    view = memoryview(buf)
+    header = _binary_header(obj)
+    data = obj["data"]
+
+    write(BINARY_MAGIC)
+    buf[0] = BINARY_VERSION
+    write(view[:1])
+    write(view[:_varint(len(header), buf)])
+    write(header)
+    write(view[:_varint(len(data), buf)])
+    previous = 0
+    for i, ppi in enumerate(data):
+        if i == 0:
+            write(view[:_varint(ppi, buf)])
+        else:
+            write(view[:_varint(_zigzag(ppi - previous), buf)])
+        previous = ppi
+
+
+def binary_length(obj):
+    """Return byte length of obj encoded by write_binary."""
+    counter = _Counter()
+    write_binary(obj, counter.write)
+    return counter.total
+
+
+def decode_binary(data):
+    """Decode binary format back to payload dict. Stand-in for the decoder
+    on the proxy side."""
+    if data[:2] != BINARY_MAGIC or data[2] != BINARY_VERSION:
+        raise ValueError("Unknown payload format")
+    pos = 3
+
+    def read_varint():
+        nonlocal pos
+        value = 0
+        shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    header_length = read_varint()
+    obj = json.loads(bytes(data[pos:pos + header_length]))
+    pos += header_length
+    count = read_varint()
+    ppis = []
+    for i in range(count):
+        if i == 0:
+            ppis.append(read_varint())
+        else:
+            ppis.append(ppis[-1] + _unzigzag(read_varint()))
+    obj["data"] = ppis
+    return obj
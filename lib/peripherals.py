@@ -1,5 +1,6 @@
-from machine import Pin, ADC
+from machine import Pin, ADC, disable_irq, enable_irq
 from fifo import Fifo
+import asyncio
 import time
 
 """peripherals library simplifies the use of a few third party devices on the
@@ -8,8 +9,9 @@ raspberry pi pico.
 
 class RotaryEncoder:
     """
-    RotaryEncoder class is used to interface a rotary encoder. The class has an
-    internal fifo that can be interfaced with the methods of the class.
+    RotaryEncoder class is used to interface a rotary encoder. Turns and button
+    edges are captured in hard interrupts into an internal fifo that is read
+    with get_event() or awaited with next_event().
     
     PARAMS:
     rot_a(int): GPIO pin of the rotary encoders a pin.
@@ -17,8 +19,20 @@ class RotaryEncoder:
     button(int): GPIO pin of the rotary push button.
     flip(bool: False):  Boolean for flipping the direction of the rotary encoder.
     scroll_speed(int): How many actions before scroll event happens. Bigger is slower.
+    acceleration(bool: False): Fast turning gives bigger steps.
     """
-    def __init__(self, rot_a, rot_b, button=None, flip=None, scroll_speed=None):
+    # Fifo event words. Low 4 bits are the event kind. Rest is the turn
+    # direction for turns and masked ticks_ms timestamp for button edges.
+    EV_TURN = 1
+    EV_PRESS = 2
+    EV_RELEASE = 3
+    TS_MASK = 0x1FFFFFF			# Timestamps fit in a small int when shifted
+    DEBOUNCE_MS = 30			# Button edges closer than this are ignored
+    ACCEL_MS = 60				# Scroll events faster than this are accelerated
+    ACCEL_MAX_STEP = 8			# Biggest step of one scroll event
+    
+    def __init__(self, rot_a, rot_b, button=None, flip=None, scroll_speed=None,
+                 acceleration=False):
         self.scroll_direction = 1		# Scrolling direction
         if flip:
             # If flip is true, scrolling direction is reversed
@@ -31,19 +45,24 @@ class RotaryEncoder:
         self.b = Pin(rot_b, mode = Pin.IN)
         self._i = 0
         self.scroll_speed = scroll_speed
-        self.fifo = Fifo(30, typecode = 'i')
+        self.acceleration = acceleration
+        self._last_scroll = time.ticks_ms()
+        self.fifo = Fifo(32, typecode = 'i')
+        self._button_words = []			# Button events put aside by get_accumulated
+        self.flag = asyncio.ThreadSafeFlag()	# Set when fifo gets an event
         self.a.irq(handler = self.handler, trigger = Pin.IRQ_RISING, hard = True)
         
+        self.hold_time_ms = 1000
+        self._press_time = None			# Timestamp of unreleased press
+        self._held_triggered = False	# Long press already returned
         self.has_button = button is not None
         if self.has_button:
             self.button = Pin(button, Pin.IN, Pin.PULL_UP)
-            self.has_button = True
-            self.last_button_state = 1
-            self._press_time = None
-            self._held_triggered = False
-            self.hold_time_ms = 1000
-        else:
-            self.has_button = False
+            self._button_state = self.button()
+            self._last_edge = time.ticks_ms()
+            self.button.irq(handler = self.button_handler,
+                            trigger = Pin.IRQ_FALLING | Pin.IRQ_RISING,
+                            hard = True)
         
     def handler(self, pin):
         if self.b():
@@ -51,47 +70,142 @@ class RotaryEncoder:
         else:
             self._i += self.scroll_direction
         
-        if self._i >= self.scroll_speed:
-            self.fifo.put(1)
+        if self._i >= self.scroll_speed or self._i <= -self.scroll_speed:
+            step = self._step()
+            if self._i < 0:
+                step = -step
+            self.fifo.put((step << 4) | RotaryEncoder.EV_TURN)
             self._i = 0
-        elif self._i <= -self.scroll_speed:
-            self.fifo.put(-1)
-            self._i = 0
-            
-    def get(self):
-        if self.fifo.has_data():
-            return self.fifo.get()
-
-    def check_button_event(self):
+            self.flag.set()
+    
+    def _step(self):
+        # Step size of a scroll event. With acceleration the step grows with
+        # scroll event rate.
+        if not self.acceleration:
+            return 1
+        now = time.ticks_ms()
+        interval = time.ticks_diff(now, self._last_scroll)
+        self._last_scroll = now
+        if interval <= 0:
+            return RotaryEncoder.ACCEL_MAX_STEP
+        return max(1, min(RotaryEncoder.ACCEL_MAX_STEP, RotaryEncoder.ACCEL_MS // interval))
+    
+    def button_handler(self, pin):
+        now = time.ticks_ms()
+        state = pin()
+        # Ignore repeated edges of the same state.
+        if state == self._button_state:
+            return
+        if time.ticks_diff(now, self._last_edge) < RotaryEncoder.DEBOUNCE_MS:
+            # Bounce or a very quick tap. Wake up the reader, which checks
+            # the pin again after the debounce window.
+            self.flag.set()
+            return
+        self._put_edge(state, now)
+    
+    def _put_edge(self, state, now):
+        self._button_state = state
+        self._last_edge = now
+        kind = RotaryEncoder.EV_PRESS if state == 0 else RotaryEncoder.EV_RELEASE
+        self.fifo.put(((now & RotaryEncoder.TS_MASK) << 4) | kind)
+        self.flag.set()
+    
+    def _sync_button(self):
+        # An edge dropped in the debounce window leaves the state behind the
+        # pin, like a release right after the press. After the window the
+        # pin level is read again and the missing edge is added. Returns True
+        # if the pin differs but the window hasn't passed yet.
         if not self.has_button:
-            return None
-
-        current_time = time.ticks_ms()
-        current_state = self.button.value()
-
-    # Button just pressed
-        if current_state == 0 and self.last_button_state == 1:
-            self._press_time = current_time
-            self._held_triggered = False
-
-    # Button held down
-        if current_state == 0 and self._press_time is not None:
-            if not self._held_triggered and time.ticks_diff(current_time, self._press_time) > self.hold_time_ms:
-                self._held_triggered = True
-                self.last_button_state = 0
-                return "long"
-
-    # Button just released
-        if current_state == 1 and self.last_button_state == 0:
-            self.last_button_state = 1
-            if not self._held_triggered:
-                return "short"
+            return False
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self._last_edge) < RotaryEncoder.DEBOUNCE_MS:
+            return self.button() != self._button_state
+        irq = disable_irq()
+        state = self.button()
+        if state != self._button_state:
+            self._put_edge(state, time.ticks_add(self._last_edge, RotaryEncoder.DEBOUNCE_MS))
+        enable_irq(irq)
+        return False
+    
+    def _held_for(self):
+        # Time the button has been held down(ms).
+        now = time.ticks_ms() & RotaryEncoder.TS_MASK
+        return (now - self._press_time) & RotaryEncoder.TS_MASK
+            
+    def get_event(self):
+        """Return next event without waiting or None if there is none. Events
+        are signed step sizes for turns and "short" or "long" for button
+        presses. Long press is returned as soon as the button has been held
+        for hold_time_ms."""
+        self._sync_button()
+        while self._button_words or self.fifo.has_data():
+            if self._button_words:
+                word = self._button_words.pop(0)
             else:
-                self._press_time = None
+                word = self.fifo.get()
+            kind = word & 0xF
+            value = word >> 4
+            if kind == RotaryEncoder.EV_TURN:
+                return value
+            if kind == RotaryEncoder.EV_PRESS:
+                self._press_time = value
                 self._held_triggered = False
-
-        self.last_button_state = current_state
+            elif kind == RotaryEncoder.EV_RELEASE and self._press_time is not None:
+                duration = (value - self._press_time) & RotaryEncoder.TS_MASK
+                held = self._held_triggered
+                self._press_time = None
+                if held:
+                    continue
+                return "long" if duration >= self.hold_time_ms else "short"
+        
+        # Button still down. Synthesize long press when hold time is reached.
+        if (self._press_time is not None and not self._held_triggered and
+                self._held_for() >= self.hold_time_ms):
+            self._held_triggered = True
+            return "long"
         return None
+    
+    def get_accumulated(self):
+        """Return all pending turns summed into one delta, 0 if there are
+        none. Button events are kept for get_event."""
+        delta = 0
+        while self.fifo.has_data():
+            word = self.fifo.get()
+            if word & 0xF == RotaryEncoder.EV_TURN:
+                delta += word >> 4
+            else:
+                self._button_words.append(word)
+        return delta
+    
+    def clear(self):
+        """Drop all pending events. Unfinished press is forgotten so its
+        release won't create a click."""
+        while self.fifo.has_data():
+            self.fifo.get()
+        self._button_words = []
+        self._press_time = None
+        self._held_triggered = False
+
+    async def next_event(self):
+        """Wait until the encoder is turned or a button event happens. Returns
+        same values as get_event. Other tasks run while waiting."""
+        while True:
+            event = self.get_event()
+            if event is not None:
+                return event
+            if self._sync_button():
+                # Pin differs from the state. Check it again after the
+                # debounce window.
+                await asyncio.sleep_ms(RotaryEncoder.DEBOUNCE_MS)
+            elif self._press_time is not None and not self._held_triggered:
+                # Wake up in time to report a long press.
+                try:
+                    await asyncio.wait_for_ms(self.flag.wait(),
+                                              self.hold_time_ms - self._held_for())
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.flag.wait()
 
 class IRS_ADC:
     """
@@ -101,9 +215,13 @@ class IRS_ADC:
     
     PARAMS:
     adc_pin_nr(int): GPIO pin of the ADC device.
+    adc(object): Object with read_u16() used instead of the ADC, for example
+    ppgsynth.PPGSynth.
     """
-    def __init__(self, adc_pin_nr):
-        self.av = ADC(adc_pin_nr) 		# Sensor ADC channel
+    def __init__(self, adc_pin_nr, adc=None):
+        if adc is None:
+            adc = ADC(adc_pin_nr)
+        self.av = adc 					# Sensor ADC channel
         self.fifo = Fifo(50) 			# Interval fifo where samples are stored
         
     def handler(self, tid):
@@ -0,0 +1,243 @@
+import math
+
+"""ppgsynth library generates synthetic PPG signals with known heart beats
+for testing the heart rate algorithm without a sensor.
+
+The generator is deterministic: the same parameters and seed give the same
+samples on the host and on the Pico. It can be used as the ADC of IRS_ADC,
+or written to a file for replay with detector.py and tools/accuracy.py.
+
+Beat times are the systolic peaks. Ground truth files have one beat time(ms)
+per line.
+
+As the ADC of IRS_ADC, next_sample() runs in the sampling timer callback. It
+uses float math, which allocates, so the callback must be a soft IRQ like
+Piotimer's. It doesn't work from a hard IRQ.
+"""
+
+
+class LCG:
+    """Linear congruential generator (Numerical Recipes constants). Own
+    generator so that results don't depend on the random module of the
+    platform."""
+    def __init__(self, seed=1):
+        self.state = seed & 0xFFFFFFFF
+
+    def next(self):
+        self.state = (self.state * 1664525 + 1013904223) & 0xFFFFFFFF
+        return self.state
+
+    def uniform(self):
+        """Float in 0-1."""
+        return (self.next() >> 8) / 16777216
+
+    def gauss(self):
+        """Approximately normal distributed float, mean 0 and SD 1. Sum of
+        four uniforms."""
+        total = self.uniform() + self.uniform() + self.uniform() + self.uniform()
+        return (total - 2) * 1.7320508
+
+
+class PPGSynth:
+    """
+    PPGSynth generates raw PPG samples like read_u16 of the sensor ADC.
+
+    Heart rate varies with a low frequency(LF) and a high frequency
+    (respiratory, HF) sine component and white noise. Artifacts are random
+    events with the given rates.
+
+    PARAMS:
+    hr(float): Mean heart rate(bpm).
+    lf(float): LF amplitude of PPI(ms). lf_freq(float): LF frequency(Hz).
+    hf(float): HF amplitude of PPI(ms). hf_freq(float): HF frequency(Hz).
+    white(float): Random PPI variation SD(ms).
+    amplitude(int): Pulse amplitude(raw units).
+    baseline(int): Signal baseline(raw units).
+    wander(int): Baseline wander amplitude(raw units).
+    wander_freq(float): Baseline wander frequency(Hz).
+    noise(float): Sensor noise SD(raw units).
+    motion_rate(float): Motion artifacts per minute.
+    motion_amplitude(int): Motion artifact amplitude(raw units).
+    dropout_rate(float): Finger off events per minute.
+    dropout_ms(int): Length of a dropout(ms).
+    saturation(int): Sensor maximum. Lower values clip the pulse tops.
+    seed(int): Random seed.
+    sample_frequency(int): Sample frequency(Hz).
+    keep_truth(bool: False): Keep beat and artifact times for truth(). They
+    grow with the recording, so leave off for long runs as an ADC.
+    """
+    MOTION_MS = 400				# Length of a motion artifact
+    MOTION_FREQ = 3				# Motion artifact oscillation(Hz)
+    DIASTOLIC_DELAY = 250		# Diastolic wave after systolic peak(ms)
+
+    def __init__(self, hr=60, lf=20, lf_freq=0.1, hf=30, hf_freq=0.25, white=10,
+                 amplitude=3000, baseline=30000, wander=1000, wander_freq=0.25,
+                 noise=50, motion_rate=0, motion_amplitude=15000,
+                 dropout_rate=0, dropout_ms=1000, saturation=65535, seed=1,
+                 sample_frequency=250, keep_truth=False):
+        self.hr = hr
+        self.lf = lf
+        self.lf_freq = lf_freq
+        self.hf = hf
+        self.hf_freq = hf_freq
+        self.white = white
+        self.amplitude = amplitude
+        self.baseline = baseline
+        self.wander = wander
+        self.wander_freq = wander_freq
+        self.noise = noise
+        self.motion_rate = motion_rate
+        self.motion_amplitude = motion_amplitude
+        self.dropout_rate = dropout_rate
+        self.dropout_ms = dropout_ms
+        self.saturation = saturation
+        self.sample_frequency = sample_frequency
+        self.keep_truth = keep_truth
+        self.random = LCG(seed)
+
+        self.n = 0						# Samples generated
+        self.beats = []					# Ground truth beat times(ms) if kept
+        self.artifacts = []				# (start, end) of motion and dropouts(ms) if kept
+        # Previous, current and next beat contribute to a sample.
+        first = self._interval(0) / 2
+        self.prev_beat = first - self._interval(first)
+        self.beat = first
+        self.next_beat = first + self._interval(first)
+        if keep_truth:
+            self.beats.append(self.beat)
+            self.beats.append(self.next_beat)
+        self.motion_start = None
+        self.motion_sign = 1
+        self.dropout_end = -1
+
+    def _interval(self, t):
+        # PPI of a beat at time t(ms).
+        seconds = t / 1000
+        return (60000 / self.hr
+                + self.lf * math.sin(2 * math.pi * self.lf_freq * seconds)
+                + self.hf * math.sin(2 * math.pi * self.hf_freq * seconds)
+                + self.white * self.random.gauss())
+
+    def _pulse(self, d):
+        # Pulse shape d ms from the systolic peak, 0-1.
+        if d < -300 or d > 700:
+            return 0
+        # Rise is faster than fall.
+        sigma = 60 if d < 0 else 90
+        systolic = math.exp(-(d * d) / (2 * sigma * sigma))
+        d -= PPGSynth.DIASTOLIC_DELAY
+        diastolic = 0.4 * math.exp(-(d * d) / (2 * 80 * 80))
+        return systolic + diastolic
+
+    def time(self):
+        """Time of the next sample(ms)."""
+        return self.n * 1000 / self.sample_frequency
+
+    def next_sample(self):
+        """Return next sample."""
+        t = self.time()
+        self.n += 1
+
+        # Move to next beat halfway between beats.
+        if t >= (self.beat + self.next_beat) / 2:
+            self.prev_beat = self.beat
+            self.beat = self.next_beat
+            self.next_beat = self.beat + self._interval(self.beat)
+            if self.keep_truth:
+                self.beats.append(self.next_beat)
+
+        value = self.baseline + self.amplitude * (
+            self._pulse(t - self.prev_beat) + self._pulse(t - self.beat)
+            + self._pulse(t - self.next_beat))
+        value += self.wander * math.sin(2 * math.pi * self.wander_freq * t / 1000)
+        value += self.noise * self.random.gauss()
+
+        # Random artifacts. Rates are per minute.
+        per_sample = 60 * self.sample_frequency
+        if self.motion_start is None and self.motion_rate:
+            if self.random.uniform() < self.motion_rate / per_sample:
+                self.motion_start = t
+                self.motion_sign = 1 if self.random.uniform() < 0.5 else -1
+                if self.keep_truth:
+                    self.artifacts.append((t, t + PPGSynth.MOTION_MS))
+        if self.motion_start is not None:
+            d = t - self.motion_start
+            if d > PPGSynth.MOTION_MS:
+                self.motion_start = None
+            else:
+                # Decaying oscillation
+                decay = 1 - d / PPGSynth.MOTION_MS
+                value += (self.motion_sign * self.motion_amplitude * decay
+                          * math.sin(2 * math.pi * PPGSynth.MOTION_FREQ * d / 1000))
+        if t > self.dropout_end and self.dropout_rate:
+            if self.random.uniform() < self.dropout_rate / per_sample:
+                self.dropout_end = t + self.dropout_ms
+                if self.keep_truth:
+                    self.artifacts.append((t, self.dropout_end))
+        if t <= self.dropout_end:
+            # Finger off the sensor.
+            value = 500 + self.noise * self.random.gauss()
+
+        if value < 0:
+            return 0
+        if value > self.saturation:
+            return int(self.saturation)
+        return int(value)
+
+    def read_u16(self):
+        """Same as machine.ADC.read_u16, so that PPGSynth can be used as the
+        ADC of IRS_ADC."""
+        return self.next_sample()
+
+    def samples(self, count):
+        """Return list of count next samples."""
+        return [self.next_sample() for _ in range(count)]
+
+    def truth(self):
+        """Beat times(ms) up to the last generated sample."""
+        if not self.keep_truth:
+            raise ValueError("PPGSynth was created without keep_truth")
+        end = self.time()
+        return [t for t in self.beats if t < end]
+
+
+def write_recording(filename, synth, seconds):
+    """Write seconds of samples from synth for replay. .ppg files are
+    written as captures, other files with one sample per line. Beat times
+    are written to filename + ".beats", so synth must keep truth."""
+    count = int(seconds * synth.sample_frequency)
+    if filename.endswith(".ppg"):
+        from capture import CaptureWriter
+        writer = CaptureWriter(filename, synth.sample_frequency)
+        for _ in range(count):
+            writer.put(synth.next_sample())
+            writer.flush()
+        writer.close()
+    else:
+        with open(filename, "w") as f:
+            for _ in range(count):
+                f.write(f"{synth.next_sample()}\n")
+    with open(filename + ".beats", "w") as f:
+        for t in synth.truth():
+            f.write(f"{round(t)}\n")
+
+
+def read_beats(filename):
+    """Read ground truth beat times(ms) written by write_recording."""
+    with open(filename) as f:
+        return [int(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    # ppgsynth.py output [seconds] [hr]
+    filename = sys.argv[1] if len(sys.argv) > 1 else "synth_250Hz.txt"
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    hr = float(sys.argv[3]) if len(sys.argv) > 3 else 60
+    synth = PPGSynth(hr=hr, keep_truth=True)
+    start = time.time()
+    write_recording(filename, synth, seconds)
+    elapsed = time.time() - start
+    print(f"{synth.n} samples, {len(synth.truth())} beats to {filename} "
+          f"in {elapsed:.1f}s ({seconds / elapsed:.0f}x real time)")
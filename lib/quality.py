@@ -0,0 +1,117 @@
+"""quality library keeps a signal quality index of the heart rate signal and
+decides when a recording has enough clean beats for HRV analysis.
+
+The relative standard error of RMSSD is about 1 / sqrt(2 * (n - 1)) for n
+successive differences, so the number of clean beat pairs needed for a
+target error is 1 + 1 / (2 * error^2). 15 % needs 23 pairs, which a clean
+signal at resting heart rate gives in about 25 s.
+"""
+
+class SignalQuality:
+    """
+    SignalQuality is updated by PeakDetector on every beat, artifact and
+    min-max update, so it is computed incrementally on the same core as the
+    detector. All state is integers.
+
+    index is 0-100 and is the product of three scores:
+    regularity: share of clean beats in the last BEAT_WINDOW beats.
+    amplitude: how stable the signal amplitude is from second to second.
+    artifacts: decaying level of recent movement artifacts.
+
+    A beat is clean if its PPI is within 1/MAX_PPI_CHANGE of the PPI average
+    and there was no artifact during it.
+
+    PARAMS:
+    target_error(float): Target relative standard error of RMSSD.
+    """
+    BEAT_WINDOW = 16			# Beats in regularity window
+    MAX_PPI_CHANGE = 5			# Clean PPI differs max 1/5 from average
+    AMPLITUDE_TOLERANCE = 2		# Score lost per percent of amplitude change
+    ARTIFACT_WEIGHT = 50		# Artifact level added per artifact
+    ARTIFACT_DECAY = 8			# Artifact level loses 1/8 every second
+    TARGET_RMSSD_ERROR = 0.15	# Relative standard error of RMSSD
+    USABLE_SHARE = 2			# 1/2 of required pairs is a usable result
+    POOR = 40					# Index below this is poor signal
+
+    def __init__(self, target_error=None):
+        target_error = target_error or SignalQuality.TARGET_RMSSD_ERROR
+        self.required_pairs = 1 + round(1 / (2 * target_error * target_error))
+        self.reset()
+
+    def reset(self):
+        self.beats = bytearray(SignalQuality.BEAT_WINDOW)	# 1 for clean beats
+        self.beat_index = 0
+        self.beat_n = 0						# Beats in window
+        self.clean_n = 0					# Clean beats in window
+        self.amplitude_avg = 0
+        self.amplitude_score = 100
+        self.artifact_level = 0
+        self.artifact_in_beat = False		# Artifact since last beat
+        self.last_clean = False
+        self.clean_pairs = 0				# Successive clean beats, all session
+        self.index = 0						# Signal quality index 0-100
+
+    def beat(self, interval, ppi_avg):
+        """Update with a detected peak. interval is the PPI(ms), or 0 if the
+        peak was rejected. ppi_avg is the PPI average before this beat."""
+        clean = 0
+        if (interval > 0 and not self.artifact_in_beat
+                and (not ppi_avg
+                     or abs(interval - ppi_avg) * SignalQuality.MAX_PPI_CHANGE <= ppi_avg)):
+            clean = 1
+        self.artifact_in_beat = False
+
+        index = self.beat_index
+        self.clean_n += clean - self.beats[index]
+        self.beats[index] = clean
+        index += 1
+        if index >= SignalQuality.BEAT_WINDOW:
+            index = 0
+        self.beat_index = index
+        if self.beat_n < SignalQuality.BEAT_WINDOW:
+            self.beat_n += 1
+
+        if clean and self.last_clean:
+            self.clean_pairs += 1
+        self.last_clean = clean
+        self.update()
+
+    def artifact(self):
+        """Update with a movement artifact."""
+        self.artifact_level += SignalQuality.ARTIFACT_WEIGHT
+        self.artifact_in_beat = True
+        self.update()
+
+    def amplitude(self, value):
+        """Update with signal amplitude(max - min) of the last second. Called
+        once per second."""
+        if value <= 0:
+            self.amplitude_score = 0
+        elif self.amplitude_avg <= 0:
+            self.amplitude_avg = value
+        else:
+            change = abs(value - self.amplitude_avg) * 100 // self.amplitude_avg
+            self.amplitude_score = max(0, 100 - change * SignalQuality.AMPLITUDE_TOLERANCE)
+            self.amplitude_avg = (self.amplitude_avg * 3 + value) // 4
+        level = self.artifact_level
+        self.artifact_level = max(0, level - level // SignalQuality.ARTIFACT_DECAY - 1)
+        self.update()
+
+    def update(self):
+        regularity = self.clean_n * 100 // self.beat_n if self.beat_n else 0
+        artifacts = max(0, 100 - self.artifact_level)
+        self.index = regularity * self.amplitude_score // 100 * artifacts // 100
+
+    def ready(self):
+        """True when there are enough clean beat pairs for the target RMSSD
+        error."""
+        return self.clean_pairs >= self.required_pairs
+
+    def usable(self):
+        """True when there are enough clean beat pairs for a less accurate
+        result. Used when a recording runs out of time."""
+        return self.clean_pairs * SignalQuality.USABLE_SHARE >= self.required_pairs
+
+    def progress(self):
+        """Share of required clean beat pairs collected, 0-1."""
+        return min(1, self.clean_pairs / self.required_pairs)
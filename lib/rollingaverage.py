@@ -1,3 +1,5 @@
+import kernels
+
 class RollingAverage:
     """For keeping track of rolling average of continuous data stream"""
     def __init__(self, size):
@@ -22,4 +24,29 @@ class RollingAverage:
     
     def get(self):
         """Return the current average."""
-        return self.sum / self.count
\ No newline at end of file
+        return self.sum / self.count
+
+
+class IntRollingAverage:
+    """Integer version of RollingAverage. Uses the rolling average kernel and
+    returns averages rounded down. No float objects are created per update."""
+    def __init__(self, size):
+        """Parameters
+
+        size (int): Size of the buffer for calculating the average.
+        """
+        self.size = size
+        self.buffer, self.state = kernels.ravg_state(size)
+
+    @property
+    def count(self):
+        """Number of values in the buffer."""
+        return self.state[2]
+
+    def update(self, new_value):
+        """Update function to push/overwrite a new value into the buffer."""
+        return kernels.ravg_update(self.buffer, self.state, new_value)
+
+    def get(self):
+        """Return the current average."""
+        return self.state[1] // self.state[2]
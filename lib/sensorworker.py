@@ -0,0 +1,147 @@
+import _thread
+import time
+import asyncio
+
+class SensorWorker:
+    """
+    SensorWorker runs on core 1 for the whole uptime and is the only
+    consumer of the sensor fifo. Core 0 controls it with commands that are
+    queued and acknowledged, so a new recording can't start before the
+    worker has really stopped the last one.
+
+    While filling, samples are stored for min-max until the pulse is found,
+    then the worker switches to running and every sample goes to the
+    detector. Pre-sampling does the same filling in the background without
+    ever starting to run, so that a recording can start warm. If a capture
+    writer is set, running samples are also passed to it.
+
+    PARAMS:
+    sensor(IRS_ADC object): Sensor whose fifo is consumed.
+    detector(PeakDetector object): Detector samples are fed to.
+    """
+    # STATES
+    IDLE = 0
+    FILLING = 1
+    RUNNING = 2
+    PRESAMPLING = 3
+    # COMMANDS
+    START = 0
+    STOP = 1
+    CONFIGURE = 2
+    PRESAMPLE = 3
+    CAPTURE = 4
+    # PULSE LOCK-ON
+    PULSE_LEVEL = 1000		# Samples over this have a finger on the sensor
+    LOCK_ON_SAMPLES = 500	# Samples over PULSE_LEVEL in a row before running
+    WARM_LOCK_ON_SAMPLES = 250	# Same when the detector is warm
+    ACK_TIMEOUT = 500		# Default command acknowledge timeout(ms)
+
+    def __init__(self, sensor, detector):
+        self.sensor = sensor
+        self.detector = detector
+        self.state = SensorWorker.IDLE
+        self.lock = _thread.allocate_lock()
+        self.commands = []		# (sequence number, command, argument)
+        self.sequence = 0		# Sequence number of last sent command
+        self.acked = 0			# Sequence number of last handled command
+        self.pulse_n = 0		# Samples over PULSE_LEVEL in a row
+        self.lock_on = SensorWorker.LOCK_ON_SAMPLES
+        self.capture = None		# CaptureWriter for raw samples
+        self.started = False
+
+    def start(self):
+        """Start worker thread on core 1. Does nothing if already started."""
+        if not self.started:
+            self.started = True
+            _thread.start_new_thread(self._run, ())
+            print("[Core 1] Worker started")
+
+    def send(self, command, argument=None):
+        """Queue command. Returns its sequence number."""
+        with self.lock:
+            self.sequence += 1
+            self.commands.append((self.sequence, command, argument))
+            return self.sequence
+
+    async def command(self, command, argument=None, timeout_ms=None):
+        """Send command and wait until worker has handled it. Returns True
+        if it was acknowledged in time."""
+        if timeout_ms is None:
+            timeout_ms = SensorWorker.ACK_TIMEOUT
+        sequence = self.send(command, argument)
+        start = time.ticks_ms()
+        while self.acked < sequence:
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                print(f"ERROR: Worker did not acknowledge command {command}")
+                return False
+            await asyncio.sleep_ms(1)
+        return True
+
+    def _handle(self, command, argument):
+        # Handle one command on core 1.
+        if command == SensorWorker.START:
+            # Argument is True for a warm start. Detector is reset here so
+            # that core 0 never touches it while samples are processed.
+            warm = bool(argument) and self.detector.is_calibrated()
+            self.detector.reset(warm=warm)
+            if warm:
+                # Pulse count from pre-sampling is still valid. After a
+                # recording it starts from zero, so the raw samples are fresh
+                # by the time the worker runs.
+                self.lock_on = SensorWorker.WARM_LOCK_ON_SAMPLES
+            else:
+                self.lock_on = SensorWorker.LOCK_ON_SAMPLES
+                self.pulse_n = 0
+            self.state = SensorWorker.FILLING
+        elif command == SensorWorker.PRESAMPLE:
+            if self.state == SensorWorker.IDLE:
+                self.pulse_n = 0
+                self.state = SensorWorker.PRESAMPLING
+        elif command == SensorWorker.STOP:
+            self.state = SensorWorker.IDLE
+            self.pulse_n = 0
+            # Only the worker reads the fifo, so it's safe to empty here.
+            self.sensor.reset_fifo()
+        elif command == SensorWorker.CAPTURE:
+            # Argument is a CaptureWriter or None to stop capturing.
+            self.capture = argument
+        elif command == SensorWorker.CONFIGURE:
+            # Argument is a dict of PeakDetector.configure arguments. The
+            # detector is changed in place, so HRA keeps reading the same
+            # object. Takes effect only between recordings.
+            if self.state in (SensorWorker.IDLE, SensorWorker.PRESAMPLING):
+                self.detector.configure(**argument)
+            else:
+                print("[Core 1] Can't reconfigure while recording")
+
+    def _run(self):
+        # Core 1 main loop. Samples are processed here and nowhere else.
+        while True:
+            if self.commands:
+                with self.lock:
+                    sequence, command, argument = self.commands.pop(0)
+                self._handle(command, argument)
+                self.acked = sequence
+
+            state = self.state
+            if state == SensorWorker.IDLE or not self.sensor.has_data():
+                # Nothing to do. The 50 sample fifo holds 200 ms at 250 Hz,
+                # so sleeping 1 ms doesn't lose samples and keeps core 1
+                # from spinning while pre-sampling in the menu.
+                time.sleep_ms(1)
+            else:
+                sample = self.sensor.get()
+                if state == SensorWorker.RUNNING:
+                    self.detector.process(sample)
+                    if self.capture is not None:
+                        self.capture.put(sample)
+                else:
+                    # Find pulse and min-max values. Restart if pulse is lost.
+                    if sample > SensorWorker.PULSE_LEVEL:
+                        self.pulse_n += 1
+                        if (self.pulse_n > self.lock_on
+                                and state == SensorWorker.FILLING):
+                            self.state = SensorWorker.RUNNING
+                    else:
+                        self.pulse_n = 0
+                    self.detector.fill(sample)
@@ -1,26 +1,34 @@
-from machine import Pin, I2C
+from bootprofiler import BootProfiler, LazyModule, profiling_requested
+# Boot profiler records time and RAM used by each import and startup step.
+# Results are printed and written to /boot_profile.txt. Enabled by creating
+# /profile_boot on the device.
+boot = BootProfiler(enabled=profiling_requested())
+import asyncio
+import time
+boot.mark("import builtins")
 from menumanager import MenuManager
+boot.mark("import menumanager")
 from historian import Historian
+boot.mark("import historian")
 from networker import Networker
+boot.mark("import networker")
 from hr_algo import HRA
+boot.mark("import hr_algo")
 from peripherals import RotaryEncoder
+boot.mark("import peripherals")
 from led import Led
-from piotimer import Piotimer
-import time
-import json
-import ssd1306
-import mip
-import hrvanalysis
+from display import Display
+from memmanager import MemoryManager
+boot.mark("import led, display, memmanager")
 import introtext
+boot.mark("import introtext")
+# Basic HRV analysis is loaded when it's first used.
+hrvanalysis = LazyModule("hrvanalysis")
 
 SSID = "KMD657_Group_6"
 PASSWORD = "Group0110"		# Lol
 BROKER_IP = "192.168.6.253"
 
-# Display pins
-SDA_PIN = 14
-SCL_PIN = 15
-
 # Status LED objects.
 PW_LED = Led(20)
 WIFI_LED = Led(21)
@@ -30,57 +38,90 @@ PW_LED.on()
 
 # Main state machine
 class Main:
+    NET_POLL_INTERVAL = 50		# Network upkeep interval(ms)
+    WIFI_CHECK_INTERVAL = 4000	# WiFi status LED update interval(ms)
+    
     def __init__(self):
         # Default startup state is mainmenu.
         self.state = self.mainmenu
         # Last state is stored for back tracking navigation.
         self.previous_state = None
+        # Id of the Kubios request user is waiting for and its response.
+        self.awaiting_id = None
+        self.kubios_result = None
+        self.error_message = ""
+        # Raw sample capture files of Kubios requests by request id.
+        self.captures = {}
 
         # Define networker object.
         self.net = Networker(SSID, PASSWORD, BROKER_IP)
+        boot.mark("init networker")
         
-        # Wifi connection check every 4 seconds.
-        self.wifi_check_timer = Piotimer(mode = Piotimer.PERIODIC,
-                                     freq = 0.25,
-                                     callback = self.wifi_check_callback)
-        
-        # Initialize I2C pin and channel
-        self.i2c = I2C(1, sda=Pin(SDA_PIN), scl=Pin(SCL_PIN), freq=400000)
-        # Initialize OLED object with I2C pin
-        self.OLED = ssd1306.SSD1306_I2C(128, 64, self.i2c)
-        
-        # Draw statrup splash screen.
-        introtext.draw_splash_screen()
+        # Initialize the display. Same object is shared by all modules.
+        self.OLED = Display()
+        boot.mark("init display")
         
         # Initialize rotary encoder object
-        self.re = RotaryEncoder(10, 11, 12, scroll_speed=3)
+        self.re = RotaryEncoder(10, 11, 12, scroll_speed=3, acceleration=True)
+        boot.mark("init encoder")
+        
+        # Initialize memory manager. Used by HRA and the debug screen.
+        self.memory = MemoryManager()
         
         # Initialize HR algorithm object
-        self.hra = HRA(display=self.OLED)
+        self.hra = HRA(display=self.OLED, encoder=self.re, memory=self.memory)
+        # MQTT reconnects wait until recordings have ended.
+        self.net.busy = self.hra.busy
+        boot.mark("init hra")
         # Initialize menu manager object
         self.menu = MenuManager(self.OLED, self.re)
-        # Initialize historian object
-        self.historian = Historian()
+        boot.mark("init menu")
+        # Initialize historian object. Loaded history is freed before
+        # recordings.
+        self.historian = Historian(self.OLED)
+        self.memory.register_cache(self.historian.unload)
+        boot.mark("init historian")
+        
+        self.connected_to_wifi = False
         
-        # DEBUG
-        # Maybe remove if rotary button is implemented
-        self.button = Pin(12, Pin.IN, Pin.PULL_UP)
+
+    async def run(self): # -----------------------------------------------------
+        # Start background tasks and run the state machine. Network bring-up
+        # runs in the background while the splash screen animates and the
+        # menu is used.
+        self.net.start("PicoBeat", "kubios-response")
+        asyncio.create_task(self.network_task())
+        asyncio.create_task(self.wifi_check_task())
+        boot.mark("start network")
         
-        # Connect to network and subscribe to MQTT
-        self.connected_to_wifi = self.net.connect_wifi()
+        # Draw statrup splash screen.
+        await introtext.draw_splash_screen(self.OLED)
+        boot.mark("splash screen")
+        boot.report()
         
-        if not self.wifi_check():
-            self.display_error("WIFICONN")
-        else:
-            self.net.sync_time() 	# Sync time with NTP
-            self.net.connect_mqtt("PicoBeat",
-                                  "kubios-response",
-                                  self.kubios_response)
+        while True:
+            await self.execute()
         
 
-    def execute(self): # -------------------------------------------------------
+    async def execute(self): # -------------------------------------------------
         # Execute current state function.
-        self.state()
+        await self.state()
+        
+        
+    async def network_task(self): # --------------------------------------------
+        # Background task for network upkeep, MQTT messages and request
+        # timeouts.
+        while True:
+            self.net.poll()
+            await asyncio.sleep_ms(Main.NET_POLL_INTERVAL)
+            
+            
+    async def wifi_check_task(self): # -----------------------------------------
+        # Background task for updating WiFi status LED.
+        while True:
+            self.wifi_check()
+            await asyncio.sleep_ms(Main.WIFI_CHECK_INTERVAL)
+        
         
     def wifi_check(self): # ----------------------------------------------------
         # wifi_check checks if WiFi is connected. Updates status variable and
@@ -93,10 +134,6 @@ class Main:
             WIFI_LED.off()
             return False
     
-    def wifi_check_callback(self, _): # ----------------------------------------
-        # Wrapper for interrupt callback function.
-        self.wifi_check()
-    
     
     def change_state(self, _state): # ------------------------------------------
         # Called to change state machine state. Saves previous state and updates
@@ -105,9 +142,13 @@ class Main:
         self.state = _state
         
         
-    def mainmenu(self): # ------------------------------------------------------
-        # Displays the main menu with selection functionality.
-        selected = self.menu.run_main_menu()
+    async def mainmenu(self): # ------------------------------------------------
+        # Displays the main menu with selection functionality. Sensor is
+        # pre-sampled while the menu is open so measurements start warm.
+        await self.hra.start_presampling()
+        selected = await self.menu.run_main_menu()
+        if selected not in (0, 1, 2, 4):
+            await self.hra.stop_presampling()
         
         # If-elif mess since python doesn't have switch-case.
         if selected == 0:	# 0 > Measure HR
@@ -118,18 +159,22 @@ class Main:
             self.change_state(self.measure_hr_2)
         elif selected == 3:	# 3 > History menu
             self.change_state(self.history)
+        elif selected == 4:	# 4 > Continuous monitoring
+            self.change_state(self.measure_hr_3)
+        elif selected == MenuManager.DEBUG_SCREEN:	# Long press > Debug
+            self.change_state(self.debug_screen)
             
     
-    def measure_hr_0(self): # --------------------------------------------------
+    async def measure_hr_0(self): # --------------------------------------------
         # Start Heart Rate Algorithm, mode 0, no returned data.
-        self.hra.start_recording(mode=0)
+        await self.hra.start_recording(mode=0)
         # After measurement is stopped. Go back to main menu.
         self.change_state(self.previous_state)
         
     
-    def measure_hr_1(self): # --------------------------------------------------
+    async def measure_hr_1(self): # --------------------------------------------
         # Start Heart Rate Algorithm, mode 1, PPI data is returned as array.
-        peaks = self.hra.start_recording(mode=1)
+        peaks = await self.hra.start_recording(mode=1)
         
         # Warning if PPI data is missing.
         if not peaks:
@@ -137,20 +182,25 @@ class Main:
             self.change_state(self.mainmenu)
             return
         # Analyze and display results.
-        hrvanalysis.analyze_and_display(peaks, self.historian, self.net)
+        await hrvanalysis.analyze_and_display(peaks, self.historian, self.OLED,
+                                              self.re, networker=self.net,
+                                              capture_file=self.hra.capture_file,
+                                              heap=self.memory.last_session)
         # Change state back to main menu.
         self.change_state(self.mainmenu)
         
         
-    def measure_hr_2(self): # --------------------------------------------------
-        # Check WiFi connection. Kubios analysis starts only if WiFi is
-        # connected.
-        if not self.connected_to_wifi:
-            self.display_error("NOWIFICONN")
+    async def measure_hr_2(self): # --------------------------------------------
+        # Kubios analysis waits only for network bring-up. If WiFi failed or
+        # MQTT is not connected, the request is queued and sent when the
+        # connection is back, and the progress screen shows it as queued.
+        if self.net.boot_stage != Networker.BOOT_DONE and not self.net.wifi_failed():
+            await self.hra.stop_presampling()
+            self.display_error("NETNOTREADY")
             return
         
         # Start Heart Rate Algorithm, mode 2, PPI data is returned as array.
-        peaks = self.hra.start_recording(mode=2)
+        peaks = await self.hra.start_recording(mode=2)
         
         # Warning if PPI data is missing.
         if not peaks:
@@ -160,57 +210,148 @@ class Main:
         
         # Define MQTT payload.
         payload = {
-            "id": time.time(),	# Current time as ID
+            "id": self.net.new_request_id(),	# Current time as ID
             "type": "RRI",
             "data": peaks,
             "analysis": {
                 "type": "readiness"
                 }
             }
-        # Send data for analyzing.
-        self.net.publish("kubios-request", json.dumps(payload))
-        # Wait for MQTT response.
-        self.net.wait_for_message()
-        # Change state to main menu.
+        # Send data for analyzing. Response is handled in kubios_response.
+        request_id = payload["id"]
+        self.kubios_result = None
+        if self.hra.capture_file:
+            self.captures[request_id] = self.hra.capture_file
+        self.awaiting_id = self.net.request(
+            "kubios-request", payload,
+            lambda response: self.kubios_response(request_id, response))
+        self.change_state(self.kubios_progress)
+
+    
+    async def measure_hr_3(self): # --------------------------------------------
+        # Start Heart Rate Algorithm, mode 3. Runs until stopped and saves
+        # HRV of every window to history.
+        await self.hra.start_recording(mode=3, on_summary=self.save_window)
         self.change_state(self.mainmenu)
+        
+        
+    def save_window(self, summary): # ------------------------------------------
+        # Monitoring window summary callback. Timestamp like in basic
+        # analysis results.
+        timestamp = time.time() + 3 * 3600
+        summary["id"] = timestamp
+        summary["time"] = timestamp
+        self.historian.add_measurement(summary, networker=self.net)
+        print(f"Window saved: HR {summary['mean_hr']}, RMSSD {summary['rmssd']}")
+    
+    
+    async def kubios_progress(self): # -----------------------------------------
+        # Progress screen while waiting for Kubios response. Clicking the
+        # rotary button leaves the analysis running in the background.
+        while self.net.is_pending(self.awaiting_id):
+            self.OLED.fill(0)
+            if self.net.pending.get(self.awaiting_id):
+                self.OLED.text("Analyzing...", 16, 16, 1)
+            else:
+                self.OLED.text("Offline. Queued", 4, 16, 1)
+            self.OLED.rect(10, 32, 108, 10, 1)
+            progress = self.net.request_progress(self.awaiting_id)
+            self.OLED.fill_rect(11, 33, int(106 * progress), 8, 1)
+            self.OLED.text("Click to exit", 12, 52, 1)
+            self.OLED.show()
+            
+            if self.re.get_event() == "short":
+                print("Kubios analysis continues in background")
+                self.awaiting_id = None
+                break
+            await asyncio.sleep_ms(50)
+        
+        # Show results if they arrived while waiting.
+        if self.kubios_result is not None:
+            response = self.kubios_result
+            self.kubios_result = None
+            self.awaiting_id = None
+            await self.historian.view_details(response, self.re)
+        
+        # Response callback may have already changed the state.
+        if self.state == self.kubios_progress:
+            self.change_state(self.mainmenu)
 
     
-    def history(self): # -------------------------------------------------------
+    async def history(self): # -------------------------------------------------
         # Display history menu.
-        self.historian.run_menu(self.menu)
+        await self.historian.run_menu(self.menu)
         # When history menu is closed. Go back to main menu.
         self.change_state(self.mainmenu)
         
         
-    def kubios_response(self, topic, response): # ------------------------------
-        # Callback function for MQTT responses.
-        response = json.loads(response)
+    async def debug_screen(self): # --------------------------------------------
+        # Heap statistics. Last recording is shown if there has been one.
+        self.re.clear()
+        while True:
+            heap = self.memory.stats()
+            self.OLED.fill(0)
+            self.OLED.text("MEMORY", 0, 0, 1)
+            self.OLED.text(f"Free: {heap['free']}", 0, 12, 1)
+            self.OLED.text(f"Used: {heap['alloc']}", 0, 22, 1)
+            self.OLED.text(f"Block: {heap['largest']}", 0, 32, 1)
+            last = self.memory.last_session
+            if last:
+                self.OLED.text(f"Rec low: {last['min_free']}", 0, 42, 1)
+                self.OLED.text(f"Rec GCs: {last['collections']}", 0, 52, 1)
+            self.OLED.show()
+            
+            if self.re.get_event() in ("short", "long"):
+                break
+            await asyncio.sleep_ms(1000)
+        self.change_state(self.mainmenu)
+        
+    
+    def kubios_response(self, request_id, response): # -------------------------
+        # Callback function for Kubios responses. Called from network task.
+        # Response is None if request timed out. Errors are shown only if
+        # the user is waiting for this request.
+        foreground = request_id == self.awaiting_id
+        # Raw sample capture is referenced from the history record.
+        capture_file = self.captures.pop(request_id, None)
+        if response is None:
+            print(f"ERROR: Kubios request {request_id} timed out")
+            if foreground:
+                self.awaiting_id = None
+                self.display_error("KUBIOSTIMEOUT")
+            return
         if response["data"] == "Invalid request":
             print("ERROR: Kubios invalid request")
-            self.display_error("INVALIDREQUEST")
+            if foreground:
+                self.display_error("INVALIDREQUEST")
             return
+        if capture_file:
+            response["capture"] = capture_file
         self.historian.add_measurement(response, networker=self.net)
-        self.historian.view_details(self.OLED, response, self.re)
         print("Kubios results saved")
+        # Results are shown only if user is still waiting for them.
+        if foreground:
+            self.kubios_result = response
         
         
     def display_error(self, error_message): # ----------------------------------
+        # Show error screen on next state machine step.
+        self.error_message = error_message
+        self.change_state(self.error)
+        
+        
+    async def error(self): # ---------------------------------------------------
         # Basic error display.
         self.OLED.fill(0)
-        self.OLED.text(f"E:{error_message}", 1, 1, 1)
+        self.OLED.text(f"E:{self.error_message}", 1, 1, 1)
         self.OLED.show()
         
         # When rotary button is clicked. Close error screen
-        if self.button() == 1:
-            while True:
-                if self.button() == 0:
-                    time.sleep(0.05)
-                    if self.button.value() == 1:
-                        self.change_state(self.mainmenu)
-                        break
+        while await self.re.next_event() not in ("short", "long"):
+            pass
+        self.change_state(self.mainmenu)
 
 # Start main state machine.
 if __name__ == "__main__":
     main = Main()
-    while True:
-        main.execute()
+    asyncio.run(main.run())
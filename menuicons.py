@@ -46,8 +46,20 @@ history_icon_data = bytearray([
     #// font edit end
 ])
 
+# Icon for the Monitor option
+monitor_width = 16
+monitor_height = 16
+monitor_icon_data = bytearray([
+    #// font edit begin : monohmsb : 16 : 16 : 16
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x40, 0x00, 0x40, 0x00, 0xa0, 0x00,
+    0xa0, 0x00, 0xa1, 0x10, 0x12, 0x29, 0x0c, 0xc5, 0x00, 0x06, 0x00, 0x02,
+    0x00, 0x00, 0x00, 0x00, 0xff, 0xff, 0x00, 0x00 
+    #// font edit end
+])
+
 # Create 16x16 framebuffers for each icon
 heart_icon   = framebuf.FrameBuffer(heart_icon_data, 16, 16, framebuf.MONO_HMSB)
 chart_icon   = framebuf.FrameBuffer(chart_icon_data, 16, 16, framebuf.MONO_HMSB)
 kubios_icon  = framebuf.FrameBuffer(kubios_icon_data, 16, 16, framebuf.MONO_HMSB)
-history_icon = framebuf.FrameBuffer(history_icon_data, 16, 16, framebuf.MONO_HMSB)
\ No newline at end of file
+history_icon = framebuf.FrameBuffer(history_icon_data, 16, 16, framebuf.MONO_HMSB)
+monitor_icon = framebuf.FrameBuffer(monitor_icon_data, 16, 16, framebuf.MONO_HMSB)
\ No newline at end of file
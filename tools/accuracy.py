@@ -0,0 +1,246 @@
+"""Measure heart beat detection accuracy against known beat times.
+
+Runs on the host. PeakDetector is run over synthetic recordings from
+ppgsynth and over recording files that have a ground truth file next to
+them (recording + ".beats", one beat time in ms per line):
+
+    python tools/accuracy.py
+    python tools/accuracy.py capture_01.ppg recording.txt --no-synthetic
+
+Detected peaks are matched to true beats after removing the detector's
+constant delay (median offset). For each recording and in total it reports:
+
+    sensitivity     matched beats / true beats
+    PPV             matched beats / detected peaks
+    PPI MAE         mean absolute error of PPIs whose both beats matched
+    RMSSD, SDNN     error of the analysis result against the true PPIs
+    samples/s       detector throughput
+
+RMSSD and SDNN errors of the total row are mean absolute errors.
+
+Use --min-sensitivity and --min-ppv to fail (exit code 1) when a detector or
+filter change makes the results worse.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "lib"))
+sys.path.insert(0, str(ROOT))
+
+from detector import PeakDetector
+from ppgsynth import PPGSynth, read_beats
+from capture import CaptureReader
+from hrvanalysis import calculate_hrv
+
+SAMPLE_FREQUENCY = 250
+TOLERANCE = 100			# Max distance of a matched peak from true beat(ms)
+SECONDS = 120			# Length of synthetic recordings
+
+# Synthetic test set. Name and PPGSynth parameters.
+SCENARIOS = [
+    ("rest 60", dict(hr=60)),
+    ("low 40", dict(hr=40)),
+    ("exercise 150", dict(hr=150, hf=5, lf=5)),
+    ("extreme 200", dict(hr=200, hf=3, lf=3, white=3)),
+    ("high hrv", dict(hr=65, lf=60, hf=80, white=30)),
+    ("noisy", dict(hr=75, noise=400)),
+    ("wander", dict(hr=70, wander=4000)),
+    ("weak", dict(hr=70, amplitude=600)),
+    ("motion", dict(hr=80, motion_rate=6)),
+    ("dropouts", dict(hr=70, dropout_rate=2)),
+    ("saturated", dict(hr=70, baseline=36000, amplitude=6000, saturation=40000)),
+]
+
+
+def synthetic_recordings(seconds, seed):
+    """Yield (name, samples, beat times) of the synthetic scenarios."""
+    for name, params in SCENARIOS:
+        synth = PPGSynth(seed=seed, sample_frequency=SAMPLE_FREQUENCY, keep_truth=True,
+                         **params)
+        samples = synth.samples(int(seconds * SAMPLE_FREQUENCY))
+        yield name, samples, synth.truth()
+
+
+def file_recording(path):
+    """Return (name, samples, beat times) of a recording file."""
+    path = Path(path)
+    if path.suffix == ".ppg":
+        samples = CaptureReader(str(path)).read()
+    else:
+        samples = [int(line) for line in path.read_text().splitlines() if line.strip()]
+    return path.name, samples, read_beats(str(path) + ".beats")
+
+
+def run_detector(samples, fixed_point, filtering):
+    """Run detector like HRA does. Returns (peak times(ms), accepted
+    (time, PPI) pairs, samples per second)."""
+    detector = PeakDetector(fixed_point=fixed_point, filtering=filtering,
+                            sample_frequency=SAMPLE_FREQUENCY)
+    fill = SAMPLE_FREQUENCY
+    for sample in samples[:fill]:
+        detector.fill(sample)
+    # Detector time starts after filling. Sample k is at (fill + k) / fs.
+    offset = (fill - 1) * 1000 / SAMPLE_FREQUENCY
+    peaks = []
+    accepted = []
+    last_peak = None
+    start = time.perf_counter()
+    for sample in samples[fill:]:
+        interval = detector.process(sample)
+        if detector.last_peak is not None and detector.last_peak != last_peak:
+            last_peak = detector.last_peak
+            peaks.append(last_peak + offset)
+        if interval:
+            accepted.append((detector.now() + offset, interval))
+    elapsed = time.perf_counter() - start
+    return peaks, accepted, (len(samples) - fill) / elapsed
+
+
+def match(peaks, beats, tolerance):
+    """Match peaks to beats. Returns (delay, {peak time: beat index})."""
+    if not peaks or not beats:
+        return 0, {}
+    # Detector finds peaks a constant time after the true beat.
+    offsets = []
+    j = 0
+    for t in peaks:
+        while j + 1 < len(beats) and abs(beats[j + 1] - t) <= abs(beats[j] - t):
+            j += 1
+        offsets.append(t - beats[j])
+    delay = statistics.median(offsets)
+
+    matched = {}
+    used = set()
+    j = 0
+    for t in peaks:
+        t -= delay
+        while j + 1 < len(beats) and beats[j + 1] <= t:
+            j += 1
+        best = None
+        for k in (j, j + 1):
+            if k < len(beats) and k not in used and abs(beats[k] - t) <= tolerance:
+                if best is None or abs(beats[k] - t) < abs(beats[best] - t):
+                    best = k
+        if best is not None:
+            used.add(best)
+            matched[t + delay] = best
+    return delay, matched
+
+
+def evaluate(name, samples, beats, args):
+    """Return result dict of one recording."""
+    peaks, accepted, speed = run_detector(samples, not args.float, not args.no_filter)
+    # Only beats inside the detection period count. First second fills
+    # the detector.
+    start = 1000
+    end = len(samples) * 1000 / SAMPLE_FREQUENCY
+    beats = [b for b in beats if start <= b < end]
+    delay, matched = match(peaks, beats, args.tolerance)
+
+    # PPI errors for accepted intervals whose both ends are matched.
+    errors = []
+    for t, ppi in accepted:
+        k = matched.get(t)
+        if k is None or k == 0:
+            continue
+        if matched.get(t - ppi) == k - 1:
+            errors.append(abs(ppi - (beats[k] - beats[k - 1])))
+
+    true_ppis = [round(b - a) for a, b in zip(beats, beats[1:])]
+    found = calculate_hrv([ppi for _, ppi in accepted]) if len(accepted) > 1 else None
+    truth = calculate_hrv(true_ppis)
+    return {
+        "name": name,
+        "beats": len(beats),
+        "peaks": len(peaks),
+        "matched": len(matched),
+        "delay": delay,
+        "ppi_errors": errors,
+        "rmssd_error": found["rmssd"] - truth["rmssd"] if found and truth else None,
+        "sdnn_error": found["sdnn"] - truth["sdnn"] if found and truth else None,
+        "speed": speed,
+    }
+
+
+def ratio(a, b):
+    return a / b if b else 0
+
+
+def mean_abs(errors):
+    """Mean of absolute errors, None if no recording has one."""
+    errors = [abs(e) for e in errors if e is not None]
+    return statistics.mean(errors) if errors else None
+
+
+def report(results):
+    """Print results table. Returns (sensitivity, PPV) of all recordings."""
+    print(f"{'recording':<16}{'beats':>6}{'peaks':>6}{'sens':>7}{'ppv':>7}"
+          f"{'delay':>7}{'ppi mae':>9}{'rmssd err':>11}{'sdnn err':>10}{'samples/s':>11}")
+
+    def row(name, r):
+        mae = statistics.mean(r["ppi_errors"]) if r["ppi_errors"] else float("nan")
+        rmssd = "-" if r["rmssd_error"] is None else f"{r['rmssd_error']:+.1f}"
+        sdnn = "-" if r["sdnn_error"] is None else f"{r['sdnn_error']:+.1f}"
+        print(f"{name:<16}{r['beats']:>6}{r['peaks']:>6}"
+              f"{ratio(r['matched'], r['beats']):>7.3f}{ratio(r['matched'], r['peaks']):>7.3f}"
+              f"{r['delay']:>7.0f}{mae:>9.1f}{rmssd:>11}{sdnn:>10}{r['speed']:>11.0f}")
+
+    for r in results:
+        row(r["name"], r)
+    total = {
+        "beats": sum(r["beats"] for r in results),
+        "peaks": sum(r["peaks"] for r in results),
+        "matched": sum(r["matched"] for r in results),
+        "delay": statistics.median(r["delay"] for r in results),
+        "ppi_errors": [e for r in results for e in r["ppi_errors"]],
+        "rmssd_error": mean_abs(r["rmssd_error"] for r in results),
+        "sdnn_error": mean_abs(r["sdnn_error"] for r in results),
+        "speed": statistics.mean(r["speed"] for r in results),
+    }
+    print("-" * 90)
+    row("total", total)
+    return ratio(total["matched"], total["beats"]), ratio(total["matched"], total["peaks"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heart beat detection accuracy.")
+    parser.add_argument("files", nargs="*",
+                        help="recordings (.ppg or one sample per line) with .beats files")
+    parser.add_argument("--no-synthetic", action="store_true",
+                        help="don't run the synthetic scenarios")
+    parser.add_argument("--seconds", type=float, default=SECONDS,
+                        help="length of synthetic recordings")
+    parser.add_argument("--seed", type=int, default=1, help="synthetic signal seed")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="peak matching tolerance(ms)")
+    parser.add_argument("--float", action="store_true",
+                        help="run the float reference detector")
+    parser.add_argument("--no-filter", action="store_true",
+                        help="disable band-pass and motion blanking")
+    parser.add_argument("--min-sensitivity", type=float, default=0,
+                        help="fail if total sensitivity is lower")
+    parser.add_argument("--min-ppv", type=float, default=0,
+                        help="fail if total PPV is lower")
+    args = parser.parse_args()
+
+    recordings = []
+    if not args.no_synthetic:
+        recordings.extend(synthetic_recordings(args.seconds, args.seed))
+    for path in args.files:
+        recordings.append(file_recording(path))
+    if not recordings:
+        parser.error("nothing to evaluate")
+
+    results = [evaluate(name, samples, beats, args) for name, samples, beats in recordings]
+    sensitivity, ppv = report(results)
+    if sensitivity < args.min_sensitivity or ppv < args.min_ppv:
+        print(f"FAIL: sensitivity {sensitivity:.3f}, PPV {ppv:.3f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Build precompiled .mpy versions of the PicoBeat modules.
+
+Runs on the host. Modules listed in package.json are cross-compiled with
+mpy-cross into build/, and build/package.json is generated so that
+mpremote mip can install the compiled files instead of the sources:
+
+    python tools/build.py
+    python -m mpremote run build/remove_sources.py
+    python -m mpremote mip install --target / http://localhost:8000/build/
+
+MicroPython imports name.py before name.mpy, so the sources of a previous
+source install must be removed first or the device keeps running them.
+build/remove_sources.py removes the .py file of every compiled module.
+
+main.py is copied as source since MicroPython only runs main.py. Libraries
+from pico-lib are left as they are.
+
+Options:
+    --manifest      Also write build/manifest.py for freezing the modules
+                    into a custom firmware.
+    --compare-boot SOURCE COMPILED
+                    Compare two /boot_profile.txt files copied from the
+                    device, one from a source install and one from a
+                    compiled install. Boot profiling is enabled by
+                    creating /profile_boot on the device.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BUILD = ROOT / "build"
+BASE_URL = "http://localhost:8000/"
+ARCH = "armv6m"		# RP2040. Needed for native and viper code.
+
+# Files that are installed as source.
+KEEP_SOURCE = {"main.py"}
+
+
+def mpy_cross_command():
+    """Return command for running mpy-cross. Standalone binary is preferred,
+    pip package mpy-cross is used if the binary is not found."""
+    binary = shutil.which("mpy-cross")
+    if binary:
+        return [binary]
+    return [sys.executable, "-m", "mpy_cross"]
+
+
+def project_files(package):
+    """Yield (target, source path) of project files in package.json."""
+    for target, url in package["urls"]:
+        if not url.startswith(BASE_URL) or "/pico-lib/" in url:
+            continue
+        source = ROOT / url[len(BASE_URL):]
+        if source.suffix == ".py":
+            yield target, source
+
+
+def compile_file(command, source, output):
+    output.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(command + ["-march=" + ARCH, "-o", str(output),
+                              "-s", source.name, str(source)], check=True)
+
+
+def build(package):
+    """Compile project files. Returns generated package dict and list of
+    (name, source size, built size)."""
+    command = mpy_cross_command()
+    urls = []
+    sizes = []
+    for target, url in package["urls"]:
+        urls.append([target, url])
+
+    built = {}
+    for target, source in project_files(package):
+        relative = source.relative_to(ROOT)
+        if relative.name in KEEP_SOURCE:
+            output = BUILD / relative
+            output.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, output)
+            built[target] = (target, output)
+        else:
+            output = (BUILD / relative).with_suffix(".mpy")
+            compile_file(command, source, output)
+            built[target] = (str(Path(target).with_suffix(".mpy")), output)
+        sizes.append((str(relative), source.stat().st_size, output.stat().st_size))
+
+    # Compiled files are served from build/. Other urls are kept.
+    for entry in urls:
+        if entry[0] in built:
+            new_target, output = built[entry[0]]
+            entry[0] = new_target
+            entry[1] = BASE_URL + output.relative_to(ROOT).as_posix()
+
+    generated = dict(package)
+    generated["urls"] = urls
+    return generated, sizes
+
+
+def write_remove_sources(generated):
+    """Write device script that removes the .py files replaced by .mpy
+    files of generated package."""
+    paths = ["/" + str(Path(target).with_suffix(".py").as_posix())
+             for target, url in generated["urls"]
+             if target.endswith(".mpy") and url.startswith(BASE_URL + "build/")]
+    lines = ["import os", "", "# Generated by tools/build.py", "for path in ("]
+    lines += [f'        "{path}",' for path in paths]
+    lines += ["        ):",
+              "    try:",
+              "        os.remove(path)",
+              "        print(\"Removed\", path)",
+              "    except OSError:",
+              "        pass"]
+    path = BUILD / "remove_sources.py"
+    path.write_text("\n".join(lines) + "\n")
+    print(f"Wrote {path}")
+
+
+def write_manifest(package):
+    """Write manifest for freezing the project modules into firmware."""
+    lines = ['include("$(PORT_DIR)/boards/manifest.py")']
+    for target, source in project_files(package):
+        if source.name in KEEP_SOURCE:
+            continue
+        # Paths in manifests are relative to the manifest file.
+        base_path = Path(os.path.relpath(source.parent, BUILD)).as_posix()
+        lines.append(f'module("{source.name}", base_path="{base_path}", opt=3)')
+    path = BUILD / "manifest.py"
+    path.write_text("\n".join(lines) + "\n")
+    print(f"Wrote {path}")
+
+
+def size_report(sizes):
+    print(f"{'file':<26}{'source':>9}{'built':>9}")
+    for name, source, built in sizes:
+        print(f"{name:<26}{source:>9}{built:>9}")
+    total_source = sum(s[1] for s in sizes)
+    total_built = sum(s[2] for s in sizes)
+    print(f"{'total':<26}{total_source:>9}{total_built:>9}"
+          f"  ({100 * total_built / total_source:.0f}%)")
+
+
+def read_boot_profile(path):
+    """Read BootProfiler file to {step: ms}."""
+    steps = {}
+    for line in Path(path).read_text().splitlines()[1:]:
+        fields = line.split("\t")
+        if len(fields) >= 2:
+            steps[fields[0]] = float(fields[1])
+    return steps
+
+
+def boot_report(source_path, compiled_path):
+    source = read_boot_profile(source_path)
+    compiled = read_boot_profile(compiled_path)
+    print(f"{'step':<24}{'source ms':>11}{'mpy ms':>9}{'diff':>9}")
+    for step in source:
+        if step in compiled:
+            diff = compiled[step] - source[step]
+            print(f"{step:<24}{source[step]:>11.1f}{compiled[step]:>9.1f}{diff:>+9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build .mpy files of PicoBeat.")
+    parser.add_argument("--manifest", action="store_true",
+                        help="write build/manifest.py for frozen modules")
+    parser.add_argument("--compare-boot", nargs=2, metavar=("SOURCE", "COMPILED"),
+                        help="compare boot profiles of source and compiled installs")
+    args = parser.parse_args()
+
+    if args.compare_boot:
+        boot_report(*args.compare_boot)
+        return
+
+    package = json.loads((ROOT / "package.json").read_text())
+    generated, sizes = build(package)
+    (BUILD / "package.json").write_text(json.dumps(generated, indent=2) + "\n")
+    print(f"Wrote {BUILD / 'package.json'}")
+    write_remove_sources(generated)
+    if args.manifest:
+        write_manifest(package)
+    size_report(sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Batch HRV analysis of many PPI series with NumPy.
+
+Runs on the host. Computes the same metrics as hrvanalysis.calculate_hrv on
+the device (mean PPI, mean HR, SDNN, RMSSD) plus extended ones (pNN50, SDSD,
+SD1, SD2, min and max HR) for thousands of series at once. Series of
+different lengths are packed into one flat array with start offsets, so
+every metric is a handful of vectorized operations over all beats:
+
+    python tools/hrvbatch.py series.jsonl --out results.csv
+    python tools/hrvbatch.py series.jsonl --verify
+    python tools/hrvbatch.py --benchmark 100000
+
+Input is JSON lines. Each line is a PPI list or an object with the list in
+"data" (Kubios request payloads) and an optional "id".
+
+--verify runs the device implementation over the same series and reports
+series whose rounded results differ.
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "lib"))
+sys.path.insert(0, str(ROOT))
+
+# Same metrics and rounding as calculate_hrv.
+DEVICE_METRICS = ["mean_hr", "mean_ppi", "rmssd", "sdnn"]
+EXTENDED_METRICS = ["pnn50", "sdsd", "sd1", "sd2", "min_hr", "max_hr"]
+MIN_BEATS = 2				# calculate_hrv returns None for less
+
+
+def pack(series):
+    """Pack list of PPI lists into (values, starts, lengths) arrays."""
+    lengths = np.fromiter((len(s) for s in series), dtype=np.int64, count=len(series))
+    values = np.fromiter((ppi for s in series for ppi in s), dtype=np.float64,
+                         count=int(lengths.sum()))
+    starts = np.zeros(len(series), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return values, starts, lengths
+
+
+def _segment_sum(values, starts):
+    # Sum of each segment. Segments must not be empty.
+    return np.add.reduceat(values, starts)
+
+
+def analyze(values, starts, lengths):
+    """Compute HRV metrics of packed series. Returns dict of metric arrays,
+    unrounded. Series with less than MIN_BEATS PPIs are NaN."""
+    count = len(lengths)
+    valid = lengths >= MIN_BEATS
+    # Work only on valid series, so that no segment is empty.
+    keep = np.repeat(valid, lengths)
+    values = values[keep]
+    lengths_v = lengths[valid]
+    starts_v = np.zeros(len(lengths_v), dtype=np.int64)
+    np.cumsum(lengths_v[:-1], out=starts_v[1:])
+    n = lengths_v.astype(np.float64)
+
+    mean_ppi = _segment_sum(values, starts_v) / n
+    deviation = values - np.repeat(mean_ppi, lengths_v)
+    sdnn = np.sqrt(_segment_sum(deviation * deviation, starts_v) / n)
+
+    # Successive differences. The difference across the boundary of two
+    # series lands on the last PPI of the earlier series and is zeroed, so
+    # every series has its n - 1 differences and a zero.
+    diffs = np.empty_like(values)
+    diffs[:-1] = np.diff(values)
+    diffs[-1:] = 0
+    diffs[starts_v[1:] - 1] = 0
+    diff_n = n - 1
+    rmssd = np.sqrt(_segment_sum(diffs * diffs, starts_v) / diff_n)
+    pnn50 = _segment_sum((np.abs(diffs) > 50).astype(np.float64), starts_v) / diff_n * 100
+    diff_mean = _segment_sum(diffs, starts_v) / diff_n
+    sdsd = np.sqrt(np.maximum(rmssd * rmssd - diff_mean * diff_mean, 0))
+    sd1 = sdsd / math.sqrt(2)
+    sd2 = np.sqrt(np.maximum(2 * sdnn * sdnn - sd1 * sd1, 0))
+    min_hr = 60000 / np.maximum.reduceat(values, starts_v)
+    max_hr = 60000 / np.minimum.reduceat(values, starts_v)
+
+    results = {}
+    for name, array in (("mean_hr", 60000 / mean_ppi), ("mean_ppi", mean_ppi),
+                        ("rmssd", rmssd), ("sdnn", sdnn), ("pnn50", pnn50),
+                        ("sdsd", sdsd), ("sd1", sd1), ("sd2", sd2),
+                        ("min_hr", min_hr), ("max_hr", max_hr)):
+        full = np.full(count, np.nan)
+        full[valid] = array
+        results[name] = full
+    results["beats"] = lengths
+    return results
+
+
+def rounded(results):
+    """Round like the device: one decimal."""
+    return {name: (np.round(array, 1) if name != "beats" else array)
+            for name, array in results.items()}
+
+
+def verify(series, results):
+    """Compare device metrics against calculate_hrv. Returns list of
+    (index, metric, batch value, device value) that differ after rounding,
+    and the number of values compared."""
+    from hrvanalysis import calculate_hrv
+    mismatches = []
+    compared = 0
+    for i, ppis in enumerate(series):
+        device = calculate_hrv(ppis) if len(ppis) >= MIN_BEATS else None
+        if device is None:
+            if not np.isnan(results["mean_ppi"][i]):
+                mismatches.append((i, "all", results["mean_ppi"][i], None))
+            continue
+        for name in DEVICE_METRICS:
+            value = float(results[name][i])
+            compared += 1
+            if round(value, 1) != device[name]:
+                mismatches.append((i, name, value, device[name]))
+    return mismatches, compared
+
+
+def read_series(path):
+    """Read (ids, series) from JSON lines file. Objects without a PPI list,
+    like local results in history.txt, are skipped."""
+    ids = []
+    series = []
+    with open(path) as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                if not isinstance(obj.get("data"), list):
+                    continue
+                ids.append(obj.get("id", number))
+                series.append(obj["data"])
+            else:
+                ids.append(number)
+                series.append(obj)
+    return ids, series
+
+
+def write_csv(path, ids, results):
+    results = rounded(results)
+    names = ["beats"] + DEVICE_METRICS + EXTENDED_METRICS
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id"] + names)
+        for i, series_id in enumerate(ids):
+            writer.writerow([series_id] + [results[name][i] for name in names])
+
+
+def synthetic_series(count, seed=1):
+    """Random PPI series of 30-600 beats for benchmarking."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(30, 600, size=count)
+    base = rng.integers(500, 1200, size=count)
+    return [list(b + np.cumsum(rng.integers(-20, 21, size=n)).clip(-300, 300))
+            for b, n in zip(base.tolist(), lengths.tolist())]
+
+
+def benchmark(count):
+    series = synthetic_series(count)
+    start = time.perf_counter()
+    packed = pack(series)
+    analyze(*packed)
+    elapsed = time.perf_counter() - start
+    beats = int(packed[2].sum())
+    print(f"{count} series, {beats} beats in {elapsed:.3f}s "
+          f"({beats / elapsed / 1e6:.1f} M beats/s, packing included)")
+    start = time.perf_counter()
+    analyze(*packed)
+    elapsed = time.perf_counter() - start
+    print(f"analysis only: {beats / elapsed / 1e6:.1f} M beats/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch HRV analysis of PPI series.")
+    parser.add_argument("input", nargs="?", help="JSON lines file of PPI series")
+    parser.add_argument("--out", help="write results CSV")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare against the device implementation")
+    parser.add_argument("--benchmark", type=int, metavar="COUNT",
+                        help="time analysis of COUNT random series")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    if not args.input:
+        parser.error("input file or --benchmark is needed")
+
+    ids, series = read_series(args.input)
+    results = analyze(*pack(series))
+    print(f"Analyzed {len(series)} series, {int(results['beats'].sum())} beats")
+    if args.out:
+        write_csv(args.out, ids, results)
+        print(f"Wrote {args.out}")
+    if args.verify:
+        mismatches, compared = verify(series, results)
+        print(f"Compared {compared} values to the device implementation")
+        for index, name, value, device in mismatches[:20]:
+            print(f"  series {ids[index]} {name}: batch {value} device {device}")
+        if mismatches:
+            print(f"{len(mismatches)} differences after rounding")
+            sys.exit(1)
+        print("All series match the device implementation")
+
+
+if __name__ == "__main__":
+    main()
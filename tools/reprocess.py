@@ -0,0 +1,265 @@
+"""Reprocess raw PPG recordings with new detector parameters.
+
+Runs on the host. Recordings are captures from the device (.ppg) or files
+with one raw sample per line (.txt). Each recording is run through the same
+PeakDetector and calculate_hrv as on the device, and one row per recording
+is appended to a CSV table:
+
+    python tools/reprocess.py data/ --out results.csv
+    python tools/reprocess.py data/ --out results.csv --threshold 0.6 --cooldown 400
+
+history.txt files found in the input are read for the results the device
+saved with each capture, so that old and new results are in the same row.
+
+Recordings are processed in a process pool, by default one process per
+core. The table is written as results come in. Rows of recordings that are
+already in the table with the same parameters are skipped, so an
+interrupted run continues where it stopped, and runs with other parameters
+add their rows to the same table. Recordings that failed are tried again.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "lib"))
+sys.path.insert(0, str(ROOT))
+
+from detector import PeakDetector
+from capture import CaptureReader
+from hrvanalysis import calculate_hrv
+
+SAMPLE_FREQUENCY = 250			# Sample frequency of .txt recordings
+HISTORY_FILE = "history.txt"
+# Other text files the device writes. They are never recordings.
+DEVICE_FILES = {"boot_profile.txt", "outbox.txt"}
+
+PARAMS = ["threshold", "cooldown", "target_error", "fixed_point", "filtering", "until_ready"]
+COLUMNS = (["file", "history_id"] + PARAMS
+           + ["samples", "seconds", "beats", "artifacts", "quality", "ready",
+              "mean_hr", "mean_ppi", "rmssd", "sdnn",
+              "saved_mean_hr", "saved_mean_ppi", "saved_rmssd", "saved_sdnn",
+              "elapsed", "error"])
+
+
+def is_text_recording(path):
+    """True if the first line of a text file is a raw sample."""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    return line.strip().isdigit()
+    except (OSError, UnicodeDecodeError):
+        pass
+    return False
+
+
+def find_inputs(paths):
+    """Return (recordings, history files) under paths. Text files are
+    recordings only if they start with a sample, so other files in copied
+    device file systems are left out."""
+    recordings = []
+    histories = []
+    for path in map(Path, paths):
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        for f in files:
+            if f.name == HISTORY_FILE:
+                histories.append(f)
+            elif f.suffix == ".ppg":
+                recordings.append(f)
+            elif (f.suffix == ".txt" and f.name not in DEVICE_FILES
+                    and is_text_recording(f)):
+                recordings.append(f)
+    return recordings, histories
+
+
+def saved_results(histories):
+    """Return {capture file name: history entry} of measurements that have a
+    capture. Kubios results are converted to the keys of local results."""
+    saved = {}
+    for path in histories:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not entry.get("capture"):
+                    continue
+                if isinstance(entry.get("data"), dict):
+                    analysis = entry["data"]["analysis"]
+                    entry = {
+                        "id": entry.get("id"),
+                        "mean_hr": analysis["mean_hr_bpm"],
+                        "mean_ppi": analysis["mean_rr_ms"],
+                        "rmssd": analysis["rmssd_ms"],
+                        "sdnn": analysis["sdnn_ms"],
+                        "capture": entry["capture"],
+                    }
+                # Device paths are like /captures/<id>.ppg
+                saved[entry["capture"].rsplit("/", 1)[-1]] = entry
+    return saved
+
+
+def read_recording(path):
+    """Return (samples, sample frequency) of a recording file."""
+    if path.suffix == ".ppg":
+        reader = CaptureReader(str(path))
+        return reader.read(), reader.sample_frequency
+    with open(path) as f:
+        return [int(line) for line in f if line.strip()], SAMPLE_FREQUENCY
+
+
+def analyze(samples, sample_frequency, params):
+    """Run detector over samples like HRA does. Returns result dict."""
+    detector = PeakDetector(fixed_point=params["fixed_point"],
+                            threshold=params["threshold"],
+                            cooldown=params["cooldown"],
+                            sample_frequency=sample_frequency,
+                            target_error=params["target_error"],
+                            filtering=params["filtering"])
+    fill = sample_frequency
+    for sample in samples[:fill]:
+        detector.fill(sample)
+    quality = detector.quality
+    used = len(samples)
+    for n, sample in enumerate(samples[fill:]):
+        detector.process(sample)
+        # Modes 1 and 2 stop as soon as there are enough clean beats.
+        if params["until_ready"] and quality.ready():
+            used = fill + n + 1
+            break
+    results = calculate_hrv(detector.peaks) or {}
+    return {
+        "samples": used,
+        "seconds": round(used / sample_frequency, 1),
+        "beats": len(detector.peaks),
+        "artifacts": detector.artifact_count,
+        "quality": quality.index,
+        "ready": quality.ready(),
+        "mean_hr": results.get("mean_hr"),
+        "mean_ppi": results.get("mean_ppi"),
+        "rmssd": results.get("rmssd"),
+        "sdnn": results.get("sdnn"),
+    }
+
+
+def process(task):
+    """Process one recording in a worker process. Returns CSV row dict.
+    Errors are returned in the row so that one bad file doesn't stop the
+    run."""
+    path, params, saved = task
+    row = {"file": path, **params}
+    if saved:
+        row["history_id"] = saved.get("id")
+        for key in ("mean_hr", "mean_ppi", "rmssd", "sdnn"):
+            row["saved_" + key] = saved.get(key)
+    start = time.perf_counter()
+    try:
+        samples, sample_frequency = read_recording(Path(path))
+        if len(samples) <= sample_frequency:
+            raise ValueError("recording is shorter than detector fill")
+        row.update(analyze(samples, sample_frequency, params))
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["elapsed"] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def done_rows(out):
+    """Return set of (file, params) keys that are already in the table."""
+    done = set()
+    if not out.exists():
+        return done
+    with open(out, newline="") as f:
+        for row in csv.DictReader(f):
+            if not row.get("error"):
+                done.add(row_key(row))
+    return done
+
+
+def row_key(row):
+    # Parameters as strings, the same way csv writes them.
+    return (row["file"],) + tuple("" if row[p] is None else str(row[p]) for p in PARAMS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess raw PPG recordings.")
+    parser.add_argument("paths", nargs="+",
+                        help="recordings and directories with recordings and history.txt files")
+    parser.add_argument("--out", default="reprocess.csv", help="results table (CSV)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--chunksize", type=int,
+                        help="recordings per worker task (default: from file count)")
+    parser.add_argument("--threshold", type=float, default=PeakDetector.TRESHOLD,
+                        help="peak detection threshold, 0-1")
+    parser.add_argument("--cooldown", type=int, default=PeakDetector.COOLDOWN,
+                        help="artifact cooldown(ms)")
+    parser.add_argument("--target-error", type=float,
+                        help="target relative RMSSD error for signal quality")
+    parser.add_argument("--float", action="store_true",
+                        help="run the float reference detector")
+    parser.add_argument("--no-filter", action="store_true",
+                        help="disable band-pass and motion blanking")
+    parser.add_argument("--until-ready", action="store_true",
+                        help="stop at enough clean beats like modes 1 and 2")
+    args = parser.parse_args()
+
+    params = {
+        "threshold": args.threshold,
+        "cooldown": args.cooldown,
+        "target_error": args.target_error,
+        "fixed_point": not args.float,
+        "filtering": not args.no_filter,
+        "until_ready": args.until_ready,
+    }
+    recordings, histories = find_inputs(args.paths)
+    saved = saved_results(histories)
+    out = Path(args.out)
+    done = done_rows(out)
+
+    tasks = []
+    for path in recordings:
+        row = {"file": str(path), **params}
+        if row_key(row) not in done:
+            tasks.append((str(path), params, saved.get(path.name)))
+    print(f"{len(recordings)} recordings, {len(saved)} with saved results, "
+          f"{len(recordings) - len(tasks)} already processed")
+    if not tasks:
+        return
+
+    workers = max(1, min(args.workers, len(tasks)))
+    # Big enough chunks to keep scheduling overhead low, small enough that
+    # the last chunks don't leave cores idle.
+    chunksize = args.chunksize or max(1, len(tasks) // (workers * 4))
+    new_file = not out.exists() or out.stat().st_size == 0
+    start = time.perf_counter()
+    failed = 0
+    with open(out, "a", newline="") as f, multiprocessing.Pool(workers) as pool:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+        for n, row in enumerate(pool.imap_unordered(process, tasks, chunksize), 1):
+            writer.writerow(row)
+            # Every finished row is kept if the run is interrupted.
+            f.flush()
+            if row.get("error"):
+                failed += 1
+                print(f"{row['file']}: {row['error']}")
+            if n % 100 == 0:
+                print(f"{n}/{len(tasks)}")
+    elapsed = time.perf_counter() - start
+    print(f"Processed {len(tasks)} recordings in {elapsed:.1f}s with {workers} processes, "
+          f"{failed} failed. Results in {out}")
+
+
+if __name__ == "__main__":
+    main()